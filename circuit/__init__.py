@@ -12,6 +12,80 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .breaker import CircuitBreaker, CircuitOpenError
-from ._threadsafe import ThreadSafeCircuitBreaker
-from ._twisted import TwistedCircuitBreaker
+"""Circuit breakers for calls to remote peers.
+
+Only L{CircuitBreaker}, its exceptions and the small classes of its
+interface are imported with the package.  Everything else is imported from
+its module on first access, so that importing the package does not pay for
+optional backends such as Twisted.
+"""
+import importlib
+import sys
+import types
+
+from .breaker import (BreakerSnapshot, CallTimeout, CircuitBreaker,
+                      CircuitOpenError, ErrorClass)
+
+_LAZY = {
+    'ThreadSafeCircuitBreaker': '._threadsafe',
+    'StripedCircuitBreaker': '._striped',
+    'TwistedCircuitBreaker': '._twisted',
+    'GeventCircuitBreaker': '._gevent',
+    'CircuitBreakerSet': '._set',
+    'SetSnapshot': '._set',
+    'StateSaver': '._persist',
+    'load_state': '._persist',
+    'save_state': '._persist',
+    'EventLog': '._events',
+    'JSONLinesWriter': '._events',
+    'TransitionEvent': '._events',
+    'CallLaterDriver': '._timer',
+    'ResetNotifier': '._timer',
+    'Timer': '._timer',
+    'TimerWheel': '._timer',
+    'HealthProber': '._prober',
+    'Retry': '._retry',
+    'RetryBudget': '._retry',
+    'TimeoutExecutor': '._timeout',
+    'Gossip': '._gossip',
+    'HistogramSnapshot': '._histogram',
+    'LatencyHistogram': '._histogram',
+}
+
+__all__ = ['BreakerSnapshot', 'CallTimeout', 'CircuitBreaker',
+           'CircuitOpenError', 'ErrorClass'] + sorted(_LAZY)
+
+
+def __getattr__(name):
+    try:
+        module_name = _LAZY[name]
+    except KeyError:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    module = importlib.import_module(module_name, __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
+
+
+if sys.version_info < (3, 7):
+    # Module level __getattr__ (PEP 562) is not supported; replace the module
+    # with an instance of a subclass that forwards to it.  The original
+    # module is kept alive so that the globals of its functions survive.
+    class _LazyModule(types.ModuleType):
+
+        def __getattr__(self, name):
+            value = __getattr__(name)
+            setattr(self, name, value)
+            return value
+
+        def __dir__(self):
+            return __dir__()
+
+    _module = _LazyModule(__name__, __doc__)
+    _module.__dict__.update(globals())
+    _module._original_module = sys.modules[__name__]
+    sys.modules[__name__] = _module
@@ -0,0 +1,123 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Structured log of circuit breaker state changes.
+
+Recording an event only appends a tuple to a bounded ring buffer (a
+L{collections.deque} with a C{maxlen}, whose C{append} and C{popleft} are
+atomic), so no locks are taken and no I/O happens on the request path.  A
+background thread drains the buffer in batches and hands them to a sink.
+"""
+import collections
+import json
+import threading
+import time
+
+from circuit.breaker import LOGGER
+
+TransitionEvent = collections.namedtuple(
+    'TransitionEvent', 'peer from_state to_state timestamp error_rate delta')
+
+
+class EventLog(object):
+    """Bounded buffer of state change events, drained by a background thread.
+
+    When the buffer is full the oldest events are overwritten and counted in
+    C{dropped}.
+    """
+
+    def __init__(self, sink, maxlen=10000, interval=1.0, batch_size=1000,
+                 clock=time.time, log=LOGGER):
+        """Initialize an event log.
+
+        @param sink: A callable that is passed a list of L{TransitionEvent}s.
+        @param maxlen: The maximum number of buffered events.
+        @param interval: Number of seconds between drains of the buffer.
+        @param batch_size: The maximum number of events passed to C{sink} in
+            one call.
+        @param clock: A callable returning the wall-clock time used to
+            timestamp events.
+        @param log: A L{logging.Logger} used to report failing sinks.
+        """
+        self._sink = sink
+        self._maxlen = maxlen
+        self._buffer = collections.deque(maxlen=maxlen)
+        self._interval = interval
+        self._batch_size = batch_size
+        self._clock = clock
+        self._log = log
+        self._stopped = threading.Event()
+        self._thread = None
+        self.dropped = 0
+
+    def record(self, peer, from_state, to_state, error_rate=None, delta=None):
+        """Record a state change.  Called by the breakers."""
+        buf = self._buffer
+        if len(buf) == self._maxlen:
+            self.dropped += 1
+        buf.append((peer, from_state, to_state, self._clock(), error_rate, delta))
+
+    def drain(self):
+        """Remove and return up to C{batch_size} buffered events."""
+        popleft = self._buffer.popleft
+        batch = []
+        try:
+            for _ in xrange(self._batch_size):
+                batch.append(TransitionEvent(*popleft()))
+        except IndexError:
+            pass
+        return batch
+
+    def flush(self):
+        """Pass all buffered events to the sink."""
+        while True:
+            batch = self.drain()
+            if not batch:
+                break
+            try:
+                self._sink(batch)
+            except Exception:
+                self._log.exception('failed to write %d circuit breaker events',
+                                    len(batch))
+
+    def start(self):
+        """Start draining the buffer in a daemon thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='circuit-event-log')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and flush the remaining events."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.flush()
+
+
+class JSONLinesWriter(object):
+    """Event sink that appends events to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        self._path = path
+
+    def __call__(self, events):
+        lines = [json.dumps(event._asdict()) for event in events]
+        with open(self._path, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
@@ -0,0 +1,80 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from circuit.breaker import CircuitBreaker
+try:
+    from gevent.lock import Semaphore
+except ImportError:
+    pass
+
+
+class GeventCircuitBreaker(CircuitBreaker):
+    """Circuit breaker that is safe to share among the greenlets of a gevent
+    hub.
+
+    State changes are serialized with a gevent semaphore, which switches to
+    other greenlets instead of blocking the hub while it is held, for
+    example by a log handler doing I/O.  While the circuit is C{half-open}
+    a single greenlet is let through to probe the peer; the others are
+    rejected with L{CircuitOpenError} until the probe finishes, or until
+    C{reset_timeout} has passed without it finishing.
+    """
+
+    def __init__(self, *args, **kwds):
+        super(GeventCircuitBreaker, self).__init__(*args, **kwds)
+        self._state_lock = Semaphore()
+        self._probe_started = None
+
+    def reconfigure(self, *args, **kwds):
+        with self._state_lock:
+            super(GeventCircuitBreaker, self).reconfigure(*args, **kwds)
+
+    def _admit(self, now):
+        with self._state_lock:
+            if self._state == 'half-open':
+                if (self._probe_started is not None
+                        and now - self._probe_started < self._open_timeout):
+                    if self._log_interval is not None:
+                        self._rejected(now)
+                    return 0.0
+                self._probe_started = now
+                return None
+            retry_after = super(GeventCircuitBreaker, self)._admit(now)
+            if retry_after is None and self._state == 'half-open':
+                self._probe_started = now
+            return retry_after
+
+    def _transition(self, from_state, to_state, error_rate=None, delta=None):
+        if from_state == 'half-open':
+            self._probe_started = None
+        super(GeventCircuitBreaker, self)._transition(
+            from_state, to_state, error_rate, delta)
+
+    def _success(self):
+        if self._state != 'half-open':
+            return
+        with self._state_lock:
+            super(GeventCircuitBreaker, self)._success()
+
+    def _error(self, exc_info=None, weight=1, open_for=None, exc=None):
+        with self._state_lock:
+            super(GeventCircuitBreaker, self)._error(exc_info, weight, open_for, exc)
+
+    def _probe_result(self, ok):
+        with self._state_lock:
+            super(GeventCircuitBreaker, self)._probe_result(ok)
+
+    def _merge_gossip(self, errors, trip):
+        with self._state_lock:
+            super(GeventCircuitBreaker, self)._merge_gossip(errors, trip)
@@ -0,0 +1,288 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sharing breaker state between nodes over UDP.
+
+Every node runs a L{Gossip} with the addresses of the other nodes.  The
+errors and state changes of the watched breakers are collected and sent to
+all peers every C{interval} seconds, one record per breaker, so a breaker
+that fails a thousand times in an interval still costs a single record.
+Records are packed into datagrams of at most C{max_packet} bytes, and at
+most C{max_rate} datagrams per second are sent to each peer; records that
+do not fit are merged into the next interval.
+
+Received errors fill the windows of the local breakers of the same name,
+and a local breaker opens when C{quorum} nodes report that theirs is open.
+Gossip is a hint: it only ever opens closed circuits, and each node still
+closes its own circuits by probing the peer.
+
+Datagram format: C{MAGIC}, a version byte and a sequence of records, each a
+C{_RECORD} header followed by the UTF-8 encoded breaker name.
+"""
+import errno
+import socket
+import struct
+import threading
+import timeit
+
+from circuit.breaker import LOGGER
+
+MAGIC = b'PCBG'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sB')
+_RECORD = struct.Struct('<HBH')
+_NO_STATE, _CLOSED, _OPEN = 0, 1, 2
+_MAX_ERRORS = 0xffff
+
+
+class Gossip(object):
+    """Shares the errors and trips of breakers with other nodes."""
+
+    def __init__(self, peers, address=('127.0.0.1', 0), interval=0.1,
+                 quorum=1, max_packet=1400, max_rate=100,
+                 clock=timeit.default_timer, log=LOGGER):
+        """Initialize a gossip endpoint and bind its socket.
+
+        @param peers: The C{(host, port)} addresses of the other nodes.
+        @param address: The address to receive gossip on.
+        @param interval: Number of seconds between sends.
+        @param quorum: The number of other nodes that must report a breaker
+            open for the local breaker of the same name to open.
+        @param max_packet: The maximum size of a datagram in bytes.
+        @param max_rate: The maximum number of datagrams per second sent to
+            each peer.
+        @param clock: A callable that takes no arguments and return the
+            current time in seconds.
+        @param log: A L{logging.Logger} used to report network errors.
+        """
+        self.peers = list(peers)
+        self._interval = interval
+        self._quorum = quorum
+        self._max_packet = max_packet
+        self._packets_per_send = max(1, int(max_rate * interval))
+        self._clock = clock
+        self._log = log
+        self._breakers = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._open_reports = {}
+        self._merging = None
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(address)
+        self.address = self._socket.getsockname()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def watch(self, breaker):
+        """Share the errors and state changes of C{breaker}, and merge those
+        reported for breakers of the same name on other nodes.
+
+        @raise ValueError: if C{breaker} has no name.
+        """
+        name = breaker._name
+        if name is None:
+            raise ValueError('breakers need a name to be gossiped about')
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        self._breakers[name] = breaker
+        breaker._gossip = self
+
+    def unwatch(self, breaker):
+        for name, watched in list(self._breakers.items()):
+            if watched is breaker:
+                del self._breakers[name]
+        breaker._gossip = None
+
+    def error(self, breaker):
+        """Count an error of C{breaker}.  Called by the breaker."""
+        with self._lock:
+            record = self._pending.get(breaker)
+            if record is None:
+                self._pending[breaker] = [1, _NO_STATE]
+            else:
+                record[0] += 1
+
+    def transition(self, breaker, to_state):
+        """Note a state change of C{breaker}.  Called by the breaker."""
+        if to_state == 'open':
+            state = _OPEN
+        elif to_state == 'closed':
+            state = _CLOSED
+        else:
+            return
+        if self._merging is breaker:
+            # Opened by gossip; the nodes that reported it already know.
+            return
+        with self._lock:
+            record = self._pending.get(breaker)
+            if record is None:
+                self._pending[breaker] = [0, state]
+            else:
+                record[1] = state
+
+    def encode(self):
+        """Remove the pending records and pack them into datagrams.
+
+        @return: A list of byte strings, at most as many as may be sent to
+            each peer in one interval.  Records that do not fit are kept for
+            the next call.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        packets = []
+        chunks = [_HEADER.pack(MAGIC, VERSION)]
+        size = _HEADER.size
+        items = list(pending.items())
+        while items:
+            breaker, (errors, state) = items.pop()
+            name = breaker._name
+            if isinstance(name, unicode):
+                name = name.encode('utf-8')
+            record_size = _RECORD.size + len(name)
+            if size + record_size > self._max_packet and len(chunks) > 1:
+                packets.append(b''.join(chunks))
+                chunks = [_HEADER.pack(MAGIC, VERSION)]
+                size = _HEADER.size
+                if len(packets) == self._packets_per_send:
+                    items.append((breaker, (errors, state)))
+                    break
+            chunks.append(_RECORD.pack(len(name), state,
+                                       min(errors, _MAX_ERRORS)))
+            chunks.append(name)
+            size += record_size
+        else:
+            if len(chunks) > 1:
+                packets.append(b''.join(chunks))
+        if items:
+            self._requeue(items)
+        return packets
+
+    def _requeue(self, items):
+        with self._lock:
+            for breaker, (errors, state) in items:
+                record = self._pending.get(breaker)
+                if record is None:
+                    self._pending[breaker] = [errors, state]
+                else:
+                    record[0] += errors
+                    if record[1] == _NO_STATE:
+                        record[1] = state
+
+    def flush(self):
+        """Send the pending records to all peers."""
+        for packet in self.encode():
+            for peer in self.peers:
+                try:
+                    self._socket.sendto(packet, peer)
+                except socket.error:
+                    self._log.debug('failed to send gossip to %s:%d', *peer,
+                                    exc_info=True)
+
+    def merge(self, data, sender):
+        """Merge a datagram received from C{sender} into the local breakers.
+
+        @raise ValueError: if C{data} is not a gossip datagram.
+        """
+        if len(data) < _HEADER.size:
+            raise ValueError('truncated gossip datagram')
+        magic, version = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a gossip datagram of version %d' % VERSION)
+        offset = _HEADER.size
+        now = self._clock()
+        while offset < len(data):
+            name_len, state, errors = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            name = data[offset:offset + name_len]
+            offset += name_len
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                continue
+            trip = False
+            if state != _NO_STATE:
+                reports = self._open_reports.setdefault(name, {})
+                if state == _OPEN:
+                    reports[sender] = now
+                else:
+                    reports.pop(sender, None)
+                trip = self._count_reports(reports, now, breaker) >= self._quorum
+            if errors or trip:
+                self._merging = breaker
+                try:
+                    breaker._merge_gossip(errors, trip)
+                finally:
+                    self._merging = None
+
+    def _count_reports(self, reports, now, breaker):
+        """Count the reports of C{breaker} being open that are recent enough
+        for the circuit of their sender to still be open."""
+        for sender, when in list(reports.items()):
+            if now - when >= breaker._reset_timeout:
+                del reports[sender]
+        return len(reports)
+
+    def receive(self, timeout=None):
+        """Wait up to C{timeout} seconds for a datagram and merge it.
+
+        @return: C{True} if a datagram was received.
+        """
+        self._socket.settimeout(timeout)
+        try:
+            data, sender = self._socket.recvfrom(65535)
+        except socket.timeout:
+            return False
+        except socket.error as e:
+            if e.errno in (errno.EINTR, errno.ECONNREFUSED):
+                return False
+            raise
+        try:
+            self.merge(data, sender)
+        except (ValueError, struct.error):
+            self._log.debug('ignoring bad gossip from %s:%d', *sender)
+        return True
+
+    def start(self):
+        """Send and receive gossip from two daemon threads."""
+        self._stopped.clear()
+        for target, name in ((self._run_sender, 'circuit-gossip-send'),
+                             (self._run_receiver, 'circuit-gossip-receive')):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def close(self):
+        self.stop()
+        self._socket.close()
+
+    def _run_sender(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.flush()
+            except Exception:
+                self._log.exception('failed to send gossip')
+
+    def _run_receiver(self):
+        while not self._stopped.is_set():
+            try:
+                self.receive(self._interval)
+            except Exception:
+                self._log.exception('failed to receive gossip')
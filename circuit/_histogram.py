@@ -0,0 +1,211 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Latency histograms of the calls made through a breaker.
+
+Latencies are counted in log-linear buckets: each power of two between
+C{2 ** MIN_EXP} and C{2 ** MAX_EXP} seconds is split into C{SUB_BUCKETS}
+linear buckets, so a latency is known to within 12.5% of its value and a
+histogram has a fixed number of counters.
+
+Each thread records into its own shard of counters, so recording takes no
+lock even when the breaker is shared between threads.  The shards are
+summed into a L{HistogramSnapshot} when the histogram is read.  The shard
+of a thread (or greenlet) that has ended is added to a single total and
+dropped, so the memory used only depends on the number of live threads.
+"""
+import math
+import struct
+import threading
+import weakref
+
+OUTCOMES = ('success', 'error', 'unhandled', 'rejected')
+_OUTCOME_INDEX = dict((outcome, i) for i, outcome in enumerate(OUTCOMES))
+
+SUB_BUCKETS = 8
+MIN_EXP = -20
+MAX_EXP = 12
+# Bucket 0 counts the latencies below 2 ** MIN_EXP seconds, the last bucket
+# also counts those above 2 ** MAX_EXP seconds.
+BUCKETS = 1 + (MAX_EXP - MIN_EXP) * SUB_BUCKETS
+
+MAGIC = b'PCBH'
+VERSION = 1
+_HEADER = struct.Struct('<4sBI')
+_ENTRY = struct.Struct('<IQ')
+
+
+def _bucket(seconds):
+    if seconds <= 0:
+        return 0
+    mantissa, exp = math.frexp(seconds)
+    if exp <= MIN_EXP:
+        return 0
+    if exp > MAX_EXP:
+        return BUCKETS - 1
+    return (1 + (exp - MIN_EXP - 1) * SUB_BUCKETS
+            + int((mantissa - 0.5) * 2 * SUB_BUCKETS))
+
+
+def bucket_upper_bound(bucket):
+    """Return the highest latency in seconds counted in C{bucket}."""
+    if bucket == 0:
+        return math.ldexp(0.5, MIN_EXP)
+    exp, sub = divmod(bucket - 1, SUB_BUCKETS)
+    return math.ldexp(0.5 + (sub + 1) / (2.0 * SUB_BUCKETS), exp + MIN_EXP + 1)
+
+
+class _Shard(object):
+
+    __slots__ = ('counts', '_owner')
+
+    def __init__(self):
+        self.counts = [0] * (len(OUTCOMES) * BUCKETS)
+        self._owner = None
+
+
+class _Owner(object):
+    """Held only by the thread-local storage of a thread, so that it is
+    freed when the thread ends."""
+
+    __slots__ = ('__weakref__',)
+
+
+class LatencyHistogram(object):
+    """Latencies of the calls of a breaker, split by outcome."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._ended = []
+        self._retired = [0] * (len(OUTCOMES) * BUCKETS)
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            owner = self._local.owner = _Owner()
+            # The callback runs when the thread ends; appending to a list is
+            # atomic, and the shard is retired under the lock later.
+            shard._owner = weakref.ref(owner, lambda ref, shard=shard,
+                                       ended=self._ended: ended.append(shard))
+            with self._lock:
+                self._retire_shards()
+                self._shards.append(shard)
+            return shard
+
+    def _retire_shards(self):
+        """Add the shards of the threads that have ended to the retired
+        counts and drop them.  Called with the lock held."""
+        while self._ended:
+            shard = self._ended.pop()
+            self._shards.remove(shard)
+            self._retired = [a + b for a, b in zip(self._retired, shard.counts)]
+
+    def record(self, outcome, seconds):
+        """Count a call with the given outcome and latency."""
+        self._shard().counts[_OUTCOME_INDEX[outcome] * BUCKETS
+                             + _bucket(seconds)] += 1
+
+    def snapshot(self):
+        """Return the counts recorded so far by all threads."""
+        with self._lock:
+            self._retire_shards()
+            shards = list(self._shards)
+            counts = list(self._retired)
+        for shard in shards:
+            counts = [a + b for a, b in zip(counts, shard.counts)]
+        return HistogramSnapshot(counts)
+
+
+class HistogramSnapshot(object):
+    """Counts of a L{LatencyHistogram} at one point in time.
+
+    Snapshots of different breakers, or of different processes, can be
+    added together.
+    """
+
+    def __init__(self, counts=None):
+        if counts is None:
+            counts = [0] * (len(OUTCOMES) * BUCKETS)
+        self.counts = counts
+
+    def _buckets(self, outcome):
+        if outcome is None:
+            return [sum(self.counts[i::BUCKETS]) for i in xrange(BUCKETS)]
+        start = _OUTCOME_INDEX[outcome] * BUCKETS
+        return self.counts[start:start + BUCKETS]
+
+    def count(self, outcome=None):
+        """Return the number of calls with the given outcome, or of all
+        calls."""
+        return sum(self._buckets(outcome))
+
+    def percentile(self, percent, outcome=None):
+        """Return the latency in seconds below which C{percent} percent of
+        the calls with the given outcome (or of all calls) finished.
+
+        @return: The upper bound of the bucket holding the percentile, or
+            C{None} if there are no such calls.
+        """
+        buckets = self._buckets(outcome)
+        total = sum(buckets)
+        if not total:
+            return None
+        rank = max(1, int(math.ceil(total * percent / 100.0)))
+        seen = 0
+        for bucket, count in enumerate(buckets):
+            seen += count
+            if seen >= rank:
+                return bucket_upper_bound(bucket)
+
+    def __add__(self, other):
+        return HistogramSnapshot([a + b for a, b in zip(self.counts, other.counts)])
+
+    def __eq__(self, other):
+        return isinstance(other, HistogramSnapshot) and self.counts == other.counts
+
+    def __ne__(self, other):
+        return not self == other
+
+    def encode(self):
+        """Encode the snapshot into a byte string, storing only the buckets
+        that are not empty."""
+        entries = [(i, count) for i, count in enumerate(self.counts) if count]
+        chunks = [_HEADER.pack(MAGIC, VERSION, len(entries))]
+        chunks.extend(_ENTRY.pack(i, count) for i, count in entries)
+        return b''.join(chunks)
+
+    @classmethod
+    def decode(cls, data):
+        """Decode a snapshot encoded by L{encode}.
+
+        @raise ValueError: if C{data} is not an encoded snapshot.
+        """
+        if len(data) < _HEADER.size:
+            raise ValueError('truncated histogram snapshot')
+        magic, version, n = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a histogram snapshot of version %d' % VERSION)
+        if len(data) != _HEADER.size + n * _ENTRY.size:
+            raise ValueError('truncated histogram snapshot')
+        snapshot = cls()
+        for k in xrange(n):
+            i, count = _ENTRY.unpack_from(data, _HEADER.size + k * _ENTRY.size)
+            if i >= len(snapshot.counts):
+                raise ValueError('bad histogram bucket %d' % i)
+            snapshot.counts[i] = count
+        return snapshot
@@ -0,0 +1,224 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Saving and restoring the state of circuit breakers across restarts.
+
+The state of a collection of breakers (a mapping from peer name to breaker)
+is stored in a compact binary file.  Timestamps are stored as ages relative
+to the time of the snapshot, so that they can be rebased on the (possibly
+monotonic) clock of the process that restores them.  The wall-clock time that
+passed between saving and restoring is added to all ages.
+
+Breakers that are closed and have no errors in their window carry no
+evidence of a failing peer and are left out of the snapshot, so the cost of
+saving and restoring grows with the number of unhealthy peers rather than
+with the size of the fleet.
+"""
+import errno
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from circuit.breaker import LOGGER
+from circuit._set import CircuitBreakerSet
+
+MAGIC = b'PCBS'
+VERSION = 4
+
+_HEADER = struct.Struct('<4sBId')
+_RECORD = struct.Struct('<HBBddH')
+_STATES = ('closed', 'open', 'half-open')
+_STATE_CODES = dict((state, code) for code, state in enumerate(_STATES))
+_NAN = float('nan')
+
+_window_structs = {}
+
+
+def _window_struct(n):
+    try:
+        return _window_structs[n]
+    except KeyError:
+        s = _window_structs[n] = struct.Struct('<%dd' % (3 * n))
+        return s
+
+
+def encode_state(breakers, wall_time=None):
+    """Encode the state of C{breakers} into a byte string.
+
+    @param breakers: A mapping from peer name to L{CircuitBreaker}.
+    @param wall_time: The wall-clock time of the snapshot; defaults to now.
+    """
+    if wall_time is None:
+        wall_time = time.time()
+    chunks = []
+    for name, breaker in list(breakers.items()):
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        (state, last_change_age, open_timeout, decayed, error_ages,
+         error_weights, num_calls) = breaker._dump_state()
+        if state == 'closed' and (not error_weights[0] if decayed else
+                                  all(age is None for age in error_ages)):
+            continue
+        n = len(error_ages)
+        chunks.append(_RECORD.pack(len(name), _STATE_CODES[state], decayed,
+                                   _NAN if last_change_age is None else last_change_age,
+                                   open_timeout, n))
+        chunks.append(name)
+        args = [_NAN if age is None else age for age in error_ages]
+        args.extend(error_weights)
+        args.extend(num_calls)
+        chunks.append(_window_struct(n).pack(*args))
+    chunks.insert(0, _HEADER.pack(MAGIC, VERSION, len(chunks) // 3, wall_time))
+    return b''.join(chunks)
+
+
+def decode_state(breakers, data, wall_time=None):
+    """Restore the state encoded by L{encode_state} into C{breakers}.
+
+    Saved peers that are not present in C{breakers} are ignored, unless
+    C{breakers} is a L{CircuitBreakerSet}, which creates their breakers.
+
+    @param wall_time: The current wall-clock time; defaults to now.
+    @return: The number of breakers restored.
+    @raise ValueError: if C{data} is not a valid state snapshot.
+    """
+    if wall_time is None:
+        wall_time = time.time()
+    try:
+        magic, version, count, saved_at = _HEADER.unpack_from(data, 0)
+    except struct.error:
+        raise ValueError('truncated state header')
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a circuit breaker state file')
+    elapsed = max(0.0, wall_time - saved_at)
+
+    create = isinstance(breakers, CircuitBreakerSet)
+    restored = 0
+    offset = _HEADER.size
+    try:
+        for _ in xrange(count):
+            (name_len, code, decayed, last_change_age, open_timeout,
+             n) = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            name = data[offset:offset + name_len].decode('utf-8')
+            offset += name_len
+            window = _window_struct(n)
+            values = window.unpack_from(data, offset)
+            offset += window.size
+
+            breaker = breakers[name] if create else breakers.get(name)
+            if breaker is None:
+                continue
+            if last_change_age != last_change_age:
+                last_change_age = None
+            else:
+                last_change_age += elapsed
+            error_ages = [None if age != age else age + elapsed
+                          for age in values[:n]]
+            breaker._load_state(_STATES[code], last_change_age, open_timeout,
+                                bool(decayed), error_ages, values[n:2 * n],
+                                values[2 * n:])
+            restored += 1
+    except (struct.error, IndexError):
+        raise ValueError('truncated state record')
+    return restored
+
+
+def save_state(breakers, path):
+    """Atomically write the state of C{breakers} to the file at C{path}.
+
+    The snapshot is written to a temporary file in the same directory that is
+    then renamed over C{path}, so readers never observe a partial file.
+    """
+    data = encode_state(breakers)
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.circuit-', dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+    except:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_state(breakers, path):
+    """Restore the state of C{breakers} from the file at C{path}.
+
+    @return: The number of breakers restored; 0 if the file does not exist.
+    @raise ValueError: if the file is not a valid state snapshot.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return 0
+        raise
+    return decode_state(breakers, data)
+
+
+class StateSaver(object):
+    """Periodically save the state of a set of breakers from a background
+    thread, keeping the disk I/O off the request path.
+    """
+
+    def __init__(self, breakers, path, interval=30.0, log=LOGGER):
+        """Initialize a state saver.
+
+        @param breakers: A mapping from peer name to L{CircuitBreaker}.
+        @param path: The file to write the state to.
+        @param interval: Number of seconds between saves.
+        @param log: A L{logging.Logger} used to report failed saves.
+        """
+        self._breakers = breakers
+        self._path = path
+        self._interval = interval
+        self._log = log
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start saving in a daemon thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='circuit-state-saver')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, save=True):
+        """Stop the background thread, saving a final snapshot if C{save}."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if save:
+            self.save()
+
+    def save(self):
+        try:
+            save_state(self._breakers, self._path)
+        except Exception:
+            self._log.exception('failed to save circuit breaker state to %s',
+                                self._path)
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.save()
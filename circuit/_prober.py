@@ -0,0 +1,97 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Active health probing of open circuits.
+
+Without a prober, the first user request after C{reset_timeout} is let
+through to probe the peer.  With a prober attached, user requests are
+rejected for as long as the circuit is open, and a user supplied probe is
+run in the background when the circuit is due for C{half-open}.  A
+successful probe closes the circuit; a failed probe keeps it open for
+another C{reset_timeout}.
+"""
+from multiprocessing.pool import ThreadPool
+
+from circuit.breaker import LOGGER
+from circuit._timer import ResetNotifier, TimerWheel
+
+
+class HealthProber(object):
+    """Runs probes for open circuits of many breakers.
+
+    The probes are scheduled on a shared L{TimerWheel} and run on a small
+    thread pool.
+    """
+
+    def __init__(self, wheel=None, workers=4, executor=None, log=LOGGER):
+        """Initialize a health prober.
+
+        @param wheel: The L{TimerWheel} to schedule probes on.  If not given,
+            the prober creates one and drives it from a thread.
+        @param workers: The number of threads running probes.
+        @param executor: A callable C{executor(func, args)} that runs
+            C{func(*args)} in the background, like L{ThreadPool.apply_async}.
+            Overrides C{workers}.
+        @param log: A L{logging.Logger} used to report failed probes.
+        """
+        self._own_wheel = wheel is None
+        self._wheel = TimerWheel() if wheel is None else wheel
+        self._workers = workers
+        self._executor = executor
+        self._notifier = ResetNotifier(self._wheel)
+        self._pool = None
+        self._log = log
+
+    def attach(self, breaker, probe):
+        """Probe the peer of C{breaker} by calling C{probe} while it is open.
+
+        The probe fails if it raises an exception or returns C{False}.
+        """
+        breaker._prober = self
+        breaker._probe = probe
+        self._notifier.watch(breaker, self._due)
+
+    def detach(self, breaker):
+        """Stop probing C{breaker}; user requests probe it again."""
+        breaker._prober = breaker._probe = None
+        self._notifier.unwatch(breaker)
+
+    def start(self):
+        if self._executor is None:
+            self._pool = ThreadPool(self._workers)
+            self._executor = self._pool.apply_async
+        if self._own_wheel:
+            self._wheel.start()
+
+    def stop(self):
+        if self._own_wheel:
+            self._wheel.stop()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = self._executor = None
+
+    def _due(self, breaker):
+        self._executor(self._run_probe, (breaker,))
+
+    def _run_probe(self, breaker):
+        probe = breaker._probe
+        if probe is None:
+            return
+        try:
+            ok = probe() is not False
+        except Exception:
+            self._log.debug('probe of %s failed', breaker._name, exc_info=True)
+            ok = False
+        breaker._probe_result(ok)
@@ -0,0 +1,195 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Retries that respect the state of a circuit breaker.
+
+Every attempt goes through the breaker, so retries count as calls and
+errors in its window like any other call.  Retries are only made while the
+circuit is closed, and each one spends a token from a L{RetryBudget} that
+is refilled by a fraction of the successful calls counted by the breaker.
+During a partial outage retries therefore stop well before they can
+multiply the load on the failing peer, and a peer that fails every call
+gets no retries once the initial tokens have been spent.
+"""
+import functools
+import threading
+import time
+
+from circuit.breaker import CircuitOpenError
+
+
+class RetryBudget(object):
+    """Token bucket of retries, refilled by the successful calls of the
+    breakers it is spent on."""
+
+    def __init__(self, ratio=0.1, max_tokens=10):
+        """Initialize a retry budget.
+
+        @param ratio: The number of tokens earned per successful call.  With
+            the default, at most one retry is made per ten successes once the
+            initial tokens have been spent.
+        @param max_tokens: The maximum (and initial) number of tokens.
+        """
+        self._ratio = ratio
+        self._max_tokens = max_tokens
+        self._tokens = float(max_tokens)
+        self._successes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    def deposit(self, calls=1):
+        """Earn tokens for C{calls} successful calls."""
+        with self._lock:
+            self._deposit(calls)
+
+    def _deposit(self, calls):
+        self._tokens = min(self._max_tokens, self._tokens + self._ratio * calls)
+
+    def _watch(self, breaker):
+        """Earn tokens for the successful calls counted by C{breaker} from
+        now on."""
+        with self._lock:
+            self._successes.setdefault(
+                breaker, breaker._calls_total - breaker._errors_total)
+
+    def withdraw(self, breaker=None):
+        """Spend a token for a retry.
+
+        @param breaker: If given, first earn tokens for the successful calls
+            counted by C{breaker} since the budget last looked at it,
+            including those made without L{Retry}.
+        @return: C{False} if the budget is exhausted.
+        """
+        with self._lock:
+            if breaker is not None:
+                successes = breaker._calls_total - breaker._errors_total
+                seen = self._successes.get(breaker, successes)
+                # Calls counted by a striped breaker lag behind its errors
+                # until they are folded; never earn for them twice.
+                if successes >= seen:
+                    self._successes[breaker] = successes
+                    self._deposit(successes - seen)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class Retry(object):
+    """Retry calls protected by a circuit breaker."""
+
+    def __init__(self, breaker, attempts=3, budget=None, backoff=0,
+                 sleep=time.sleep, reactor=None):
+        """Initialize a retry helper.
+
+        @param breaker: The L{CircuitBreaker} protecting the calls.  Only
+            exceptions of its C{error_types} are retried.
+        @param attempts: The maximum number of attempts per call.
+        @param budget: The L{RetryBudget} to spend retries from, refilled
+            by the calls counted by C{breaker}.  May be shared between
+            several helpers.  Defaults to a new budget.
+        @param backoff: Number of seconds to wait before the first retry,
+            doubled for every following retry.
+        @param sleep: Callable used to wait between attempts by L{call}.
+        @param reactor: The L{IReactorTime} used to wait between attempts by
+            L{call_deferred}.  Defaults to the global reactor.
+        """
+        self._breaker = breaker
+        self._attempts = attempts
+        self._budget = RetryBudget() if budget is None else budget
+        self._budget._watch(breaker)
+        self._backoff = backoff
+        self._sleep = sleep
+        self._reactor = reactor
+
+    def __call__(self, func):
+        """Decorate a function to be called through L{call}."""
+        @functools.wraps(func)
+        def wrapped(*args, **kwds):
+            return self.call(func, *args, **kwds)
+        return wrapped
+
+    def _should_retry(self, exc, attempt):
+        """Decide whether to retry after attempt number C{attempt} failed
+        with C{exc}."""
+        return (attempt < self._attempts
+                and isinstance(exc, self._breaker._error_types)
+                and self._breaker._state == 'closed'
+                and self._budget.withdraw(self._breaker))
+
+    def _delay(self, attempt):
+        return self._backoff * 2 ** (attempt - 1)
+
+    def call(self, func, *args, **kwds):
+        """Call C{func(*args, **kwds)} in the breaker, retrying failed
+        attempts while the circuit is closed and the budget allows it.
+
+        @raise CircuitOpenError: if the circuit is open.
+        """
+        attempt = 1
+        while True:
+            try:
+                with self._breaker.weighted(1):
+                    result = func(*args, **kwds)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+            else:
+                return result
+            delay = self._delay(attempt)
+            if delay:
+                self._sleep(delay)
+            attempt += 1
+
+    def call_deferred(self, func, *args, **kwds):
+        """Like L{call}, for a C{func} that returns a L{defer.Deferred}.
+
+        @return: A L{defer.Deferred} firing with the result of the first
+            successful attempt, or failing with the error of the last one.
+        """
+        from twisted.internet import defer, task
+
+        def attempt(number):
+            try:
+                start = self._breaker._enter()
+            except CircuitOpenError:
+                return defer.fail()
+            d = defer.maybeDeferred(func, *args, **kwds)
+            d.addCallbacks(succeeded, failed, callbackArgs=(start,),
+                           errbackArgs=(number, start))
+            return d
+
+        def succeeded(result, start):
+            self._breaker.__exit__(None, None, None, 1, start)
+            return result
+
+        def failed(failure, number, start):
+            self._breaker.__exit__(failure.type, failure.value,
+                                   failure.getTracebackObject(), 1, start)
+            if not self._should_retry(failure.value, number):
+                return failure
+            delay = self._delay(number)
+            if not delay:
+                return attempt(number + 1)
+            if self._reactor is None:
+                from twisted.internet import reactor
+                self._reactor = reactor
+            return task.deferLater(self._reactor, delay, attempt, number + 1)
+
+        return attempt(1)
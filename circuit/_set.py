@@ -0,0 +1,159 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import threading
+import timeit
+
+from circuit.breaker import CircuitBreaker
+
+SetSnapshot = collections.namedtuple(
+    'SetSnapshot', 'peers states errors calls retry_after')
+
+
+class CircuitBreakerSet(object):
+    """Circuit breakers for many peers, created on first use.
+
+    The set is a mapping from peer to breaker, so it can be passed to
+    L{save_state} and L{load_state}; the latter creates the breakers of the
+    saved peers.
+    """
+
+    def __init__(self, factory=CircuitBreaker, clock=timeit.default_timer, **kwds):
+        """Initialize a set of circuit breakers.
+
+        @param factory: The breaker class, or any callable taking the same
+            arguments, used to create the breaker of a peer.
+        @param clock: A callable that takes no arguments and return the
+            current time in seconds.  Shared by all breakers of the set.
+        @param kwds: Keyword arguments passed to C{factory}.  The peer is
+            passed as C{name}.
+        """
+        self._factory = factory
+        self._clock = clock
+        self._kwds = kwds
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, peer):
+        breaker = self._breakers.get(peer)
+        if breaker is None:
+            with self._lock:
+                breaker = self._get_or_create(peer)
+        return breaker
+
+    def _get_or_create(self, peer):
+        breaker = self._breakers.get(peer)
+        if breaker is None:
+            breaker = self._breakers[peer] = self._factory(
+                name=peer, clock=self._clock, **self._kwds)
+        return breaker
+
+    def context(self, peer):
+        """Return the breaker of C{peer}, to be used as a context manager."""
+        return self[peer]
+
+    def get(self, peer, default=None):
+        """Return the breaker of C{peer} if it has been created."""
+        return self._breakers.get(peer, default)
+
+    def __contains__(self, peer):
+        return peer in self._breakers
+
+    def __iter__(self):
+        return iter(list(self._breakers))
+
+    def __len__(self):
+        return len(self._breakers)
+
+    def items(self):
+        return self._breakers.items()
+
+    def reconfigure(self, **kwds):
+        """Change the thresholds of all breakers in the set, and of those
+        created later.  See L{CircuitBreaker.reconfigure}.
+
+        @raise ValueError: if the new thresholds are invalid; no breaker is
+            changed then.
+        """
+        with self._lock:
+            # Validate on a throwaway breaker before touching live ones.
+            throwaway = dict(self._kwds)
+            throwaway.pop('gossip', None)
+            self._factory(clock=self._clock, **throwaway).reconfigure(**kwds)
+            for breaker in list(self._breakers.values()):
+                breaker.reconfigure(**kwds)
+            for key, value in kwds.items():
+                if value is not None:
+                    if key in ('time_unit', 'max_error_rate'):
+                        value = value or None
+                    self._kwds[key] = value
+
+    def snapshot(self):
+        """Return a L{SetSnapshot} of all breakers of the set: a list of
+        peers, and one list per field of L{BreakerSnapshot} in the same
+        order.
+
+        The clock is read once.  Each breaker is read under its own lock, if
+        it has one, and the lock of the set is only held while the breakers
+        are listed, so request threads are held up for at most the time it
+        takes to read a single breaker.
+        """
+        with self._lock:
+            peers = list(self._breakers)
+            breakers = list(self._breakers.values())
+        now = self._clock()
+        states, errors, calls, retry_after = [], [], [], []
+        for breaker in breakers:
+            state, error_count, call_count, due = breaker._snapshot(now)
+            states.append(state)
+            errors.append(error_count)
+            calls.append(call_count)
+            retry_after.append(due)
+        return SetSnapshot(peers, states, errors, calls, retry_after)
+
+    def admit(self, peers):
+        """Check which of C{peers} can be called right now.
+
+        This is equivalent to entering the breaker of each peer, but reads the
+        clock once and takes the lock of the set at most once.  Open circuits
+        that are due are moved into C{half-open}, so the admitted peers must
+        then be called and their outcome reported through their breakers.
+
+        @return: A tuple C{(admitted, rejected)} where C{admitted} is a list
+            of the peers that are let through and C{rejected} is a dict
+            mapping each rejected peer to the number of seconds until its
+            circuit is due for C{half-open}.
+        """
+        breakers = self._breakers
+        missing = [peer for peer in peers if peer not in breakers]
+        if missing:
+            with self._lock:
+                for peer in missing:
+                    self._get_or_create(peer)
+
+        now = self._clock()
+        admitted = []
+        rejected = {}
+        for peer in peers:
+            breaker = breakers[peer]
+            if breaker._state == 'closed' and breaker._ramp_start is None:
+                admitted.append(peer)
+                continue
+            retry_after = breaker._admit(now)
+            if retry_after is None:
+                admitted.append(peer)
+            else:
+                rejected[peer] = retry_after
+        return admitted, rejected
@@ -0,0 +1,136 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import weakref
+
+from circuit.breaker import CircuitBreaker
+from circuit._threadsafe import ThreadSafeCircuitBreaker
+
+
+class _Counter(object):
+
+    __slots__ = ('calls', '_owner')
+
+    def __init__(self):
+        self.calls = 0
+        self._owner = None
+
+
+class _Owner(object):
+    """Held only by the thread-local storage of a thread, so that it is
+    freed when the thread ends."""
+
+    __slots__ = ('__weakref__',)
+
+
+class StripedCircuitBreaker(ThreadSafeCircuitBreaker):
+    """Thread-safe circuit breaker for interpreters without a global lock.
+
+    L{ThreadSafeCircuitBreaker} counts successful calls with an unlocked
+    increment, which relies on the global interpreter lock to not lose
+    updates, and would become a point of contention if it were locked.
+    Here each thread counts its calls in a counter of its own that only it
+    writes to.  The counters only ever grow; the calls they counted since
+    the last error are moved into the window of errors, under the lock,
+    when the next error is recorded or the breaker is read.  Successful
+    calls through a closed circuit therefore take no lock and write to no
+    shared memory.  The counter of a thread that has ended is added to a
+    single total and dropped, so threads that come and go do not grow the
+    breaker.
+
+    With C{half_life} the moving averages are updated under the lock.
+    """
+
+    def __init__(self, *args, **kwds):
+        super(StripedCircuitBreaker, self).__init__(*args, **kwds)
+        self._local = threading.local()
+        self._counters = []
+        self._ended = []
+        self._retired = 0
+        self._folded = 0
+
+    def _new_counter(self):
+        counter = self._local.counter = _Counter()
+        owner = self._local.owner = _Owner()
+        # The callback runs when the thread ends; appending to a list is
+        # atomic, and the counter is retired under the lock later.
+        counter._owner = weakref.ref(owner, lambda ref, counter=counter,
+                                     ended=self._ended: ended.append(counter))
+        with self._state_lock:
+            self._retire_counters()
+            self._counters.append(counter)
+        return counter
+
+    def _retire_counters(self):
+        """Drop the counters of the threads that have ended, keeping their
+        calls.  Called with the lock held."""
+        while self._ended:
+            counter = self._ended.pop()
+            self._counters.remove(counter)
+            self._retired += counter.calls
+
+    def _count_call(self, weight):
+        if self._half_life is not None:
+            with self._state_lock:
+                CircuitBreaker._count_call(self, weight)
+            return
+        try:
+            counter = self._local.counter
+        except AttributeError:
+            counter = self._new_counter()
+        counter.calls += weight
+
+    def _fold_calls(self):
+        """Move the calls counted by the threads since the last fold into
+        the current slot of the window.  Called with the lock held."""
+        self._retire_counters()
+        total = self._retired
+        for counter in self._counters:
+            total += counter.calls
+        self._calls_total += total - self._folded
+        if self._half_life is None:
+            self._num_calls[-1] += total - self._folded
+        self._folded = total
+
+    def _add_error(self, now, weight):
+        self._fold_calls()
+        return super(StripedCircuitBreaker, self)._add_error(now, weight)
+
+    def _add_class_error(self, window, now, weight):
+        self._fold_calls()
+        return super(StripedCircuitBreaker, self)._add_class_error(
+            window, now, weight)
+
+    def reconfigure(self, *args, **kwds):
+        with self._state_lock:
+            self._fold_calls()
+            CircuitBreaker.reconfigure(self, *args, **kwds)
+
+    def _snapshot(self, now):
+        with self._state_lock:
+            self._fold_calls()
+            return CircuitBreaker._snapshot(self, now)
+
+    def _dump_state(self):
+        with self._state_lock:
+            self._fold_calls()
+            return CircuitBreaker._dump_state(self)
+
+    def _load_state(self, *args):
+        with self._state_lock:
+            # Calls counted before the restore are not part of the restored
+            # window.
+            self._fold_calls()
+            CircuitBreaker._load_state(self, *args)
@@ -1,5 +1,5 @@
 import threading
-from circuit.breaker import CircuitBreaker
+from circuit.breaker import CircuitBreaker, CircuitOpenError
 
 class ThreadSafeCircuitBreaker(CircuitBreaker):
     """Circuit breaker that is safe to share among different threads."""
@@ -7,12 +7,93 @@ class ThreadSafeCircuitBreaker(CircuitBreaker):
     def __init__(self, *args, **kwds):
         super(ThreadSafeCircuitBreaker, self).__init__(*args, **kwds)
         self._state_lock = threading.Lock()
+        self._state_changed = threading.Condition(self._state_lock)
+        self._waiting_leader = None
 
-    def __enter__(self):
-        if self._state != 'open':
+    def reconfigure(self, *args, **kwds):
+        with self._state_lock:
+            super(ThreadSafeCircuitBreaker, self).reconfigure(*args, **kwds)
+
+    def _admit(self, now):
+        if self._state != 'open' and self._ramp_start is None:
+            return None
+        with self._state_lock:
+            return super(ThreadSafeCircuitBreaker, self)._admit(now)
+
+    def waiting(self, timeout=None):
+        """Return a context manager that waits for the circuit to let the
+        request through instead of failing immediately.
+
+        Waiting threads block until the circuit closes.  When an open circuit
+        is due for C{half-open}, a single waiting thread is let through to
+        probe the peer.
+
+        On Python 2 a timed wait on a L{threading.Condition} polls, sleeping
+        up to 50 milliseconds at a time.  The thread waiting for the circuit
+        to be due, and every thread waiting with a C{timeout}, therefore
+        wake up to 20 times a second and may be let through up to 50
+        milliseconds late.  The other threads block without polling until
+        they are notified.
+
+        @param timeout: The maximum number of seconds to wait, or C{None} to
+            wait for as long as it takes.
+        @raise CircuitOpenError: if the circuit is still open after
+            C{timeout} seconds.
+        """
+        return _WaitingContext(self, timeout)
+
+    def _wait(self, timeout):
+        """Block until the circuit lets the calling thread through."""
+        if self._state == 'closed':
             return
+        me = threading.current_thread()
         with self._state_lock:
-            super(ThreadSafeCircuitBreaker, self).__enter__()
+            try:
+                deadline = None if timeout is None else self._clock() + timeout
+                while True:
+                    if self._state == 'closed':
+                        return
+                    now = self._clock()
+                    reset_in = None
+                    if self._state == 'open':
+                        reset_in = (self._open_timeout
+                                    - (now - self._last_change))
+                        if reset_in <= 0 and self._prober is None:
+                            super(ThreadSafeCircuitBreaker, self)._admit(now)
+                            return
+                    remaining = None if deadline is None else deadline - now
+                    if remaining is not None and remaining <= 0:
+                        raise CircuitOpenError()
+                    # Only one thread sleeps until the circuit is due for
+                    # half-open, the others wait to be notified.
+                    wait = remaining
+                    leader = False
+                    if (reset_in is not None and self._prober is None
+                            and self._waiting_leader is None):
+                        self._waiting_leader = me
+                        leader = True
+                        wait = (reset_in if remaining is None
+                                else min(reset_in, remaining))
+                    # On Python 2 a timed wait polls, see waiting().
+                    try:
+                        self._state_changed.wait(wait)
+                    finally:
+                        if leader:
+                            self._waiting_leader = None
+            except:
+                # A leader that gives up hands over to another waiter, which
+                # would otherwise not be woken when the circuit is due.
+                if self._waiting_leader is None:
+                    self._state_changed.notify()
+                raise
+
+    def _transition(self, from_state, to_state, error_rate=None, delta=None):
+        super(ThreadSafeCircuitBreaker, self)._transition(
+            from_state, to_state, error_rate, delta)
+        if to_state == 'closed':
+            self._state_changed.notify_all()
+        elif to_state == 'open' and self._waiting_leader is None:
+            self._state_changed.notify()
 
     def _success(self):
         if self._state != 'half-open':
@@ -20,6 +101,46 @@ class ThreadSafeCircuitBreaker(CircuitBreaker):
         with self._state_lock:
             super(ThreadSafeCircuitBreaker, self)._success()
 
-    def _error(self, exc_info=None):
+    def _error(self, exc_info=None, weight=1, open_for=None, exc=None):
+        with self._state_lock:
+            super(ThreadSafeCircuitBreaker, self)._error(exc_info, weight, open_for, exc)
+
+    def _merge_gossip(self, errors, trip):
+        with self._state_lock:
+            super(ThreadSafeCircuitBreaker, self)._merge_gossip(errors, trip)
+
+    def _probe_result(self, ok):
         with self._state_lock:
-            super(ThreadSafeCircuitBreaker, self)._error(exc_info)
+            super(ThreadSafeCircuitBreaker, self)._probe_result(ok)
+
+    def _snapshot(self, now):
+        with self._state_lock:
+            return super(ThreadSafeCircuitBreaker, self)._snapshot(now)
+
+    def _dump_state(self):
+        with self._state_lock:
+            return super(ThreadSafeCircuitBreaker, self)._dump_state()
+
+    def _load_state(self, *args):
+        with self._state_lock:
+            super(ThreadSafeCircuitBreaker, self)._load_state(*args)
+
+
+class _WaitingContext(object):
+    """Context manager returned by L{ThreadSafeCircuitBreaker.waiting}."""
+
+    __slots__ = ('_breaker', '_timeout', '_start')
+
+    def __init__(self, breaker, timeout):
+        self._breaker = breaker
+        self._timeout = timeout
+        self._start = None
+
+    def __enter__(self):
+        breaker = self._breaker
+        breaker._wait(self._timeout)
+        if breaker._latency is not None:
+            self._start = breaker._clock()
+
+    def __exit__(self, exc_type, exc_val, tb):
+        return self._breaker.__exit__(exc_type, exc_val, tb, 1, self._start)
@@ -0,0 +1,131 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Calls with a deadline.
+
+A thread cannot be interrupted, so a call with a timeout is run on a worker
+of a bounded pool while the caller waits for it.  When the timeout expires
+the caller is freed and the call is recorded as an error; the worker stays
+busy until the hung call returns.  Calls that are still queued when their
+timeout expires are never started, and calls that find the threads busy and
+the queue full fail at once with L{CallTimeout}, so a hung peer cannot grow
+the number of threads or the backlog of work.
+"""
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+
+from circuit.breaker import CallTimeout
+
+
+class _Task(object):
+    """A call queued on the pool, that can be cancelled until it starts."""
+
+    __slots__ = ('func', 'args', 'kwds', 'result', 'exc_info', 'done',
+                 '_lock', '_claimed')
+
+    def __init__(self, func, args, kwds):
+        self.func = func
+        self.args = args
+        self.kwds = kwds
+        self.result = self.exc_info = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self._claimed = False
+
+    def _claim(self):
+        with self._lock:
+            claimed, self._claimed = self._claimed, True
+            return not claimed
+
+    def run(self):
+        if not self._claim():
+            return
+        try:
+            self.result = self.func(*self.args, **self.kwds)
+        except Exception:
+            self.exc_info = sys.exc_info()
+        self.done.set()
+
+    def cancel(self):
+        """Cancel the task.  Does nothing if it has already started."""
+        self._claim()
+
+
+class TimeoutExecutor(object):
+    """Runs calls with a timeout on a bounded pool of threads, shared by
+    many breakers."""
+
+    def __init__(self, workers=8, backlog=None):
+        """Initialize an executor.
+
+        @param workers: The number of threads.  At most this many hung calls
+            are waited on at a time; further calls queue until a thread is
+            free, or until their timeout expires.
+        @param backlog: The number of calls that may queue for a thread,
+            counting those that timed out but have not been dropped from the
+            queue yet.  Calls beyond it fail at once.  Defaults to
+            C{workers}.
+        """
+        self._workers = workers
+        self._slots = threading.Semaphore(
+            workers + (workers if backlog is None else backlog))
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def call(self, breaker, timeout, func, *args, **kwds):
+        """Call C{func(*args, **kwds)} in the context of C{breaker}, giving
+        up after C{timeout} seconds.
+
+        @raise CircuitOpenError: if the circuit is open.
+        @raise CallTimeout: if the call did not finish in time, or if all
+            threads are busy and the queue is full.  The call is recorded as
+            an error of C{breaker}.
+        """
+        start = breaker._enter()
+        if not self._slots.acquire(False):
+            breaker._timed_out(1, start)
+            raise CallTimeout()
+        task = _Task(func, args, kwds)
+        self._get_pool().apply_async(self._run, (task,))
+        if not task.done.wait(timeout):
+            task.cancel()
+            breaker._timed_out(1, start)
+            raise CallTimeout()
+        if task.exc_info is not None:
+            exc_type, exc_val, tb = task.exc_info
+            breaker.__exit__(exc_type, exc_val, tb, 1, start)
+            raise exc_type, exc_val, tb
+        breaker.__exit__(None, None, None, 1, start)
+        return task.result
+
+    def _run(self, task):
+        try:
+            task.run()
+        finally:
+            self._slots.release()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(self._workers)
+        return self._pool
+
+    def close(self):
+        """Stop the threads once the calls they are running return."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
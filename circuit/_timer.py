@@ -0,0 +1,259 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A hierarchical timer wheel for scheduling timeouts of many breakers.
+
+Time is divided into ticks.  The first level of the wheel has one slot per
+tick; each following level has slots spanning a full turn of the level
+below it.  Timers are put in the lowest level that covers their deadline and
+are moved down a level when the level below has turned around to their
+slot.  Scheduling and cancelling a timer are O(1), and advancing the wheel
+only visits the slots of the ticks that have passed.
+
+The wheel is advanced by a driver: L{TimerWheel.start} runs one in a thread,
+and L{CallLaterDriver} runs one on an event loop such as the Twisted reactor
+or an asyncio loop.
+"""
+import math
+import threading
+import timeit
+
+from circuit.breaker import LOGGER
+
+
+class Timer(object):
+    """A callback scheduled on a L{TimerWheel}."""
+
+    __slots__ = ('tick', 'callback', 'args', 'cancelled', '_slot')
+
+    def __init__(self, tick, callback, args):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self._slot = None
+
+    @property
+    def active(self):
+        return self._slot is not None and not self.cancelled
+
+    def cancel(self):
+        """Cancel the timer.  Cancelling a fired timer does nothing.
+
+        The timer is flagged before it is removed from its slot, so it does
+        not fire even if the wheel is moving it to another slot at the same
+        time.
+        """
+        self.cancelled = True
+        slot = self._slot
+        if slot is not None:
+            self._slot = None
+            slot.discard(self)
+
+
+class TimerWheel(object):
+    """Hierarchical timer wheel, shared by many breakers."""
+
+    def __init__(self, tick=0.1, size=256, levels=3, clock=timeit.default_timer,
+                 log=LOGGER):
+        """Initialize a timer wheel.
+
+        @param tick: The resolution of the wheel in seconds.  Timers fire at
+            most one tick late.
+        @param size: The number of slots of each level of the wheel.
+        @param levels: The number of levels.  Timers further away than
+            C{size ** levels} ticks stay in the last level until they are due.
+        @param clock: A callable that takes no arguments and return the
+            current time in seconds.
+        @param log: A L{logging.Logger} used to report failing callbacks.
+        """
+        self.tick = tick
+        self._size = size
+        self._spans = [size ** level for level in xrange(levels)]
+        self._levels = [[set() for _ in xrange(size)] for _ in xrange(levels)]
+        self._clock = clock
+        self._log = log
+        self._lock = threading.Lock()
+        self._current = int(clock() / tick)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def schedule(self, delay, callback, *args):
+        """Call C{callback(*args)} after C{delay} seconds.
+
+        @return: A L{Timer} that can be cancelled.
+        """
+        tick = int(math.ceil((self._clock() + delay) / self.tick))
+        with self._lock:
+            timer = Timer(max(tick, self._current + 1), callback, args)
+            self._insert(timer)
+        return timer
+
+    def _insert(self, timer):
+        remaining = timer.tick - self._current
+        level = 0
+        last = len(self._spans) - 1
+        while level < last and remaining >= self._spans[level + 1]:
+            level += 1
+        slot = self._levels[level][(timer.tick // self._spans[level]) % self._size]
+        timer._slot = slot
+        slot.add(timer)
+
+    def _take(self, slot, due, until):
+        """Remove the timers of C{slot}, collecting those due at tick
+        C{until} in C{due} and putting the others back in the wheel."""
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            if timer.cancelled:
+                timer._slot = None
+            elif timer.tick <= until:
+                timer._slot = None
+                due.append(timer)
+            else:
+                self._insert(timer)
+
+    def advance(self):
+        """Fire all timers that are due according to C{clock}."""
+        target = int(self._clock() / self.tick)
+        due = []
+        with self._lock:
+            if target - self._current > 2 * self._size:
+                # Far behind: sweep the whole wheel once instead of turning
+                # it tick by tick.
+                self._current = target
+                for slots in self._levels:
+                    for slot in slots:
+                        self._take(slot, due, target)
+            while self._current < target:
+                self._current = tick = self._current + 1
+                for level in xrange(len(self._spans) - 1, 0, -1):
+                    span = self._spans[level]
+                    if tick % span == 0:
+                        self._take(self._levels[level][(tick // span) % self._size],
+                                   due, tick)
+                self._take(self._levels[0][tick % self._size], due, tick)
+        for timer in due:
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                self._log.exception('timer callback %r failed', timer.callback)
+
+    def start(self):
+        """Advance the wheel from a daemon thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='circuit-timer-wheel')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.tick):
+            self.advance()
+
+
+class CallLaterDriver(object):
+    """Advance a L{TimerWheel} from an event loop.
+
+    Works with any C{call_later(delay, func)} callable returning a handle
+    with a C{cancel} method, such as C{reactor.callLater} in Twisted or
+    C{loop.call_later} in asyncio.
+    """
+
+    def __init__(self, wheel, call_later):
+        self._wheel = wheel
+        self._call_later = call_later
+        self._call = None
+
+    def start(self):
+        if self._call is None:
+            self._call = self._call_later(self._wheel.tick, self._run)
+
+    def stop(self):
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+
+    def _run(self):
+        self._call = self._call_later(self._wheel.tick, self._run)
+        self._wheel.advance()
+
+
+class ResetNotifier(object):
+    """Call back when the open circuits of breakers are due for C{half-open}.
+
+    Without a notifier the move to C{half-open} only happens when a request
+    enters the breaker; a notifier lets the application learn about it as
+    soon as C{reset_timeout} expires, for example to put the peer back into
+    a load balancing pool.
+    """
+
+    def __init__(self, wheel):
+        """Initialize a notifier.
+
+        @param wheel: The L{TimerWheel} to schedule the callbacks on.
+        """
+        self._wheel = wheel
+        self._callbacks = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def watch(self, breaker, callback):
+        """Call C{callback(breaker)} whenever the open circuit of C{breaker} is
+        due for C{half-open}."""
+        self._callbacks[breaker] = callback
+        if self not in breaker._reset_notifiers:
+            breaker._reset_notifiers = breaker._reset_notifiers + (self,)
+        if breaker._state == 'open':
+            self.schedule(breaker)
+
+    def unwatch(self, breaker):
+        breaker._reset_notifiers = tuple(
+            n for n in breaker._reset_notifiers if n is not self)
+        with self._lock:
+            self._callbacks.pop(breaker, None)
+            timer = self._timers.pop(breaker, None)
+        if timer is not None:
+            timer.cancel()
+
+    def schedule(self, breaker):
+        """Schedule the callback of C{breaker} for when its open circuit is
+        due.  Called by the breaker when it opens."""
+        opened_at = breaker._last_change
+        delay = breaker._open_timeout - (breaker._clock() - opened_at)
+        with self._lock:
+            timer = self._wheel.schedule(max(0, delay), self._due, breaker,
+                                         opened_at)
+            previous = self._timers.get(breaker)
+            self._timers[breaker] = timer
+        if previous is not None:
+            previous.cancel()
+
+    def _due(self, breaker, opened_at):
+        with self._lock:
+            if breaker._state != 'open' or breaker._last_change != opened_at:
+                # The circuit was closed, or opened again and the timer of
+                # the new open circuit calls back instead.
+                return
+            self._timers.pop(breaker, None)
+            callback = self._callbacks.get(breaker)
+        if callback is not None:
+            callback(breaker)
@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from circuit.breaker import CircuitBreaker
+from circuit.breaker import CallTimeout, CircuitBreaker, CircuitOpenError
 try:
     from twisted.internet import defer
 except ImportError:
@@ -24,7 +24,118 @@ class TwistedCircuitBreaker(CircuitBreaker):
     exceptions in its internal workings.
     """
 
-    def __exit__(self, exc_type, exc_val, tb):
+    def __init__(self, *args, **kwds):
+        """Initialize a circuit breaker.
+
+        Takes the arguments of L{CircuitBreaker} and an optional C{reactor}
+        keyword argument, the L{IReactorTime} used to schedule wakeups of
+        L{wait}.  Defaults to the global reactor.
+        """
+        self._reactor = kwds.pop('reactor', None)
+        super(TwistedCircuitBreaker, self).__init__(*args, **kwds)
+        self._waiters = []
+        self._wakeup = None
+
+    def __exit__(self, exc_type, exc_val, tb, weight=1, start=None):
         if exc_type is defer._DefGen_Return:
             exc_type, exc_val, tb = None, None, None
-        return CircuitBreaker.__exit__(self, exc_type, exc_val, tb)
+        return CircuitBreaker.__exit__(self, exc_type, exc_val, tb, weight,
+                                       start)
+
+    def call_with_timeout(self, timeout, func, *args, **kwds):
+        """Call C{func(*args, **kwds)}, which returns a L{defer.Deferred}, in
+        the context of the breaker, cancelling it after C{timeout} seconds.
+
+        @return: A L{defer.Deferred} firing with the result of the call.  It
+            fails with L{CircuitOpenError} if the circuit is open, and with
+            L{CallTimeout} if the call was cancelled.  A cancelled call is
+            recorded as an error.
+        """
+        try:
+            start = self._enter()
+        except CircuitOpenError:
+            return defer.fail()
+        d = defer.maybeDeferred(func, *args, **kwds)
+        d.addTimeout(timeout, self._get_reactor())
+        d.addCallbacks(self._call_succeeded, self._call_failed,
+                       callbackArgs=(start,), errbackArgs=(start,))
+        return d
+
+    def _call_succeeded(self, result, start):
+        self.__exit__(None, None, None, 1, start)
+        return result
+
+    def _call_failed(self, failure, start):
+        if failure.check(defer.TimeoutError):
+            self._timed_out(1, start)
+            raise CallTimeout()
+        self.__exit__(failure.type, failure.value, failure.getTracebackObject(),
+                      1, start)
+        return failure
+
+    def wait(self, timeout=None):
+        """Wait for the circuit to let a request through.
+
+        The returned L{defer.Deferred} fires when the circuit closes.  When an
+        open circuit is due for C{half-open}, a single waiter is fired to
+        probe the peer.  The caller should enter the breaker right away in
+        the callback.
+
+        @param timeout: The maximum number of seconds to wait, or C{None} to
+            wait for as long as it takes.
+        @return: A L{defer.Deferred} that fails with L{CircuitOpenError} if
+            the circuit is still open after C{timeout} seconds.
+        """
+        if self._state == 'closed':
+            return defer.succeed(None)
+        d = defer.Deferred()
+        if timeout is not None:
+            call = self._get_reactor().callLater(timeout, self._expire, d)
+            d.addBoth(self._cancel_call, call)
+        self._waiters.append(d)
+        self._schedule_wakeup()
+        return d
+
+    def _get_reactor(self):
+        if self._reactor is None:
+            from twisted.internet import reactor
+            self._reactor = reactor
+        return self._reactor
+
+    def _cancel_call(self, result, call):
+        if call.active():
+            call.cancel()
+        return result
+
+    def _expire(self, d):
+        self._waiters.remove(d)
+        d.errback(CircuitOpenError())
+
+    def _schedule_wakeup(self):
+        """Arrange for a waiter to be fired when the open circuit is due for
+        C{half-open}."""
+        if (self._state != 'open' or self._prober is not None
+                or self._wakeup is not None or not self._waiters):
+            return
+        delay = self._open_timeout - (self._clock() - self._last_change)
+        self._wakeup = self._get_reactor().callLater(max(0, delay), self._wake_one)
+
+    def _wake_one(self):
+        self._wakeup = None
+        if self._state == 'open' and self._waiters:
+            self._waiters.pop(0).callback(None)
+        # The woken waiter did not use its chance to probe the peer.
+        self._schedule_wakeup()
+
+    def _transition(self, from_state, to_state, error_rate=None, delta=None):
+        super(TwistedCircuitBreaker, self)._transition(
+            from_state, to_state, error_rate, delta)
+        if to_state == 'closed':
+            waiters, self._waiters = self._waiters, []
+            for d in waiters:
+                d.callback(None)
+        elif to_state == 'open':
+            if self._wakeup is not None:
+                self._wakeup.cancel()
+                self._wakeup = None
+            self._schedule_wakeup()
@@ -23,22 +23,104 @@ from __future__ import division
 import collections
 import functools
 import logging
+import math
+import random
+import sys
 import timeit
 
 LOGGER = logging.getLogger('python-circuit')
 LOGGER.addHandler(logging.NullHandler())
 
+# Fraction of the requests admitted at the start of a slow start.
+_RAMP_START = 0.05
+
 
 class CircuitOpenError(Exception):
     """The circuit breaker is open."""
 
 
+BreakerSnapshot = collections.namedtuple(
+    'BreakerSnapshot', 'state errors calls retry_after')
+
+
+class CallTimeout(Exception):
+    """A call did not finish within its timeout.  Always recorded as an
+    error, whatever the C{error_types} of the breaker."""
+
+
+def _check_thresholds(time_unit, max_error_rate, half_life):
+    if time_unit is max_error_rate is half_life is None:
+        raise ValueError("At least one of {time_unit, max_error_rate, half_life} must be specified")
+    if time_unit is not None and half_life is not None:
+        raise ValueError('time_unit and half_life are mutually exclusive')
+    if max_error_rate is not None and not (0 < max_error_rate <= 1):
+        raise ValueError('max_error_rate must be between 0 and 1')
+
+
+def _check_slow_start(slow_start, slow_start_curve):
+    if slow_start is not None and slow_start <= 0:
+        raise ValueError('slow_start must be positive')
+    if slow_start_curve not in ('linear', 'exponential'):
+        raise ValueError("slow_start_curve must be 'linear' or 'exponential'")
+
+
+def _resize(window, size, empty):
+    """Resize C{window} in place, dropping or padding at the oldest end."""
+    while len(window) > size:
+        window.popleft()
+    while len(window) < size:
+        window.appendleft(empty)
+
+
+class ErrorClass(object):
+    """Errors of some types that are counted in a window of their own, with
+    thresholds of their own, see the C{error_classes} argument of
+    L{CircuitBreaker}."""
+
+    def __init__(self, error_types, max_fail, time_unit=None,
+                 max_error_rate=None):
+        """Initialize an error class.
+
+        @param error_types: The exception types of the class.
+        @param max_fail: The number of latest errors of the class to keep
+            track of.  See L{CircuitBreaker} for how C{max_fail},
+            C{time_unit} and C{max_error_rate} open the circuit.
+        """
+        _check_thresholds(time_unit, max_error_rate, None)
+        self.error_types = tuple(error_types)
+        self.max_fail = max_fail
+        self.time_unit = time_unit
+        self.max_error_rate = max_error_rate
+
+
+class _ClassWindow(object):
+    """The window of errors of an L{ErrorClass} in one breaker.  Instead of
+    the calls between errors, the total number of calls of the breaker at
+    the time of each error is kept."""
+
+    __slots__ = ('error_types', 'max_fail', 'time_unit', 'max_error_rate',
+                 'times', 'weights', 'calls')
+
+    def __init__(self, error_class):
+        self.error_types = error_class.error_types
+        self.max_fail = error_class.max_fail
+        self.time_unit = error_class.time_unit
+        self.max_error_rate = error_class.max_error_rate
+        self.times = collections.deque([None] * error_class.max_fail)
+        self.weights = collections.deque([0] * error_class.max_fail)
+        self.calls = collections.deque([0] * error_class.max_fail)
+
+
 class CircuitBreaker(object):
     """A single circuit with breaker logic."""
 
     def __init__(self, max_fail, time_unit=None, max_error_rate=None,
                  reset_timeout=10, error_types=(),
-                 log=LOGGER, log_tracebacks=False, clock=timeit.default_timer):
+                 log=LOGGER, log_tracebacks=False, clock=timeit.default_timer,
+                 name=None, events=None, traceback_sample_rate=1.0,
+                 log_interval=None, weight=None, half_life=None,
+                 classify=None, slow_start=None, slow_start_curve='linear',
+                 gossip=None, latency_histogram=False, error_classes=()):
         """Initialize a circuit breaker.
 
         @param max_fail: The number of latest errors to keep track of. This is
@@ -50,9 +132,17 @@ class CircuitBreaker(object):
                period) is greater or equal than C{max_error_rate}.
             3. If both C{time_unit} and C{max_error_rate} are given, the circuit
                opens when both conditions of (1) and (2) are true.
+            4. If C{half_life} is given, no window of errors is kept.  The
+               circuit opens when the time-decayed error count exceeds
+               C{max_fail} and, if C{max_error_rate} is given, the decayed
+               error rate is greater or equal than C{max_error_rate}.
 
         @param time_unit: Time window (in seconds) for keeping track of errors.
 
+        @param half_life: Half-life (in seconds) of the exponentially weighted
+            moving averages of calls and errors.  Replaces C{time_unit} and
+            uses constant memory regardless of C{max_fail}.
+
         @param max_error_rate: Maximum allowed running error rate for the
             circuit to remain closed.
 
@@ -62,99 +152,710 @@ class CircuitBreaker(object):
         @param error_types: The exception types to be treated as errors by the
             circuit breaker.
 
+        @param error_classes: A sequence of L{ErrorClass}.  Errors of the
+            types of a class (the first that matches) are counted in a window
+            of their own, against the thresholds of the class, instead of in
+            the window of the breaker.  All classes share the call count of
+            the breaker, and any of them can open its circuit.  The types of
+            the classes need not be listed in C{error_types}.  Cannot be used
+            with C{half_life}.
+
+        @param classify: An optional callable that is passed each exception
+            of one of C{error_types} and returns C{False} if it should not be
+            treated as an error after all, C{True} or C{None} if it is an
+            error, or a number of seconds.  A number opens the circuit right
+            away and keeps it open for that long instead of C{reset_timeout},
+            for example to honor the C{Retry-After} of an overloaded peer.
+
+        @param slow_start: If given, the number of seconds over which traffic
+            is ramped up after the circuit closes again.  The ramp starts by
+            admitting a small fraction of the requests, rejecting the others
+            with L{CircuitOpenError}.  During the ramp the circuit opens
+            again as soon as the errors since it closed exceed C{max_fail}
+            times the fraction of requests currently admitted.
+
+        @param slow_start_curve: How the admitted fraction grows during a
+            slow start: C{'linear'} or C{'exponential'}.
+
         @param log: A L{logging.Logger} object that is used by the circuit breaker.
             Alternatively it can be a string specifying a descendant of L{LOGGER}.
 
         @param log_tracebacks: If true, log the traceback of the exceptions that
             cause the circuit to open.
 
+        @param traceback_sample_rate: The fraction of circuit openings for
+            which the traceback is logged when C{log_tracebacks} is true.
+
+        @param log_interval: If given, log at most one traceback per
+            C{log_interval} seconds, and log a summary of the number of
+            requests rejected with L{CircuitOpenError} at most once per
+            C{log_interval} seconds.
+
+        @param weight: An optional callable that is passed the arguments of
+            a decorated function and returns the weight of the call.  Calls
+            that are not given a weight count as 1.  The error rate compared
+            against C{max_error_rate} is the total weight of the failed calls
+            divided by the total weight of all calls.
+
         @param clock: A callable that takes no arguments and return the current
             time in seconds.
+
+        @param name: The name of the peer protected by the breaker, used to
+            identify it in state change events.  Defaults to C{log} if that is
+            a string.
+
+        @param events: An optional L{EventLog} that state changes are recorded
+            to.
+
+        @param gossip: An optional L{Gossip} that shares the errors and state
+            changes of the breaker with other nodes, and merges theirs.
+
+        @param latency_histogram: If true, keep a histogram of the latencies
+            of the calls, measured with C{clock}, see L{latencies}.  The
+            start time of a call is kept by the object that makes it (the
+            decorator, L{weighted} or L{iterate}), so calls that overlap in
+            one thread are timed correctly; a bare C{with breaker:} has
+            nowhere to keep it and only records rejections.
         """
-        if time_unit is max_error_rate is None:
-            raise ValueError("At least one of {time_unit, max_error_rate} must be specified")
-        if max_error_rate is not None and not (0 < max_error_rate <= 1):
-            raise ValueError('max_error_rate must be between 0 and 1')
+        _check_thresholds(time_unit, max_error_rate, half_life)
+        _check_slow_start(slow_start, slow_start_curve)
+        if error_classes and half_life is not None:
+            raise ValueError('error_classes cannot be used with half_life')
         if isinstance(log, basestring):
+            if name is None:
+                name = log
             log = LOGGER.getChild(log)
 
         self._max_fail = max_fail
         self._time_unit = time_unit
         self._max_error_rate = max_error_rate
         self._reset_timeout = reset_timeout
-        self._error_types = tuple(error_types)
+        self._open_timeout = reset_timeout
+        self._error_classes = [_ClassWindow(c) for c in error_classes]
+        self._error_types = tuple(error_types) + tuple(
+            t for c in error_classes for t in c.error_types)
+        self._classify = classify
         self._log = log
         self._log_tracebacks = log_tracebacks
+        self._traceback_sample_rate = traceback_sample_rate
+        self._log_interval = log_interval
         self._clock = clock
+        self._weight = weight
+        self._name = name
+        self._events = events
+        self._prober = None
+        self._probe = None
+        self._reset_notifiers = ()
+        self._slow_start = slow_start
+        self._slow_start_curve = slow_start_curve
+        self._ramp_start = None
+        self._ramp_errors = 0
+        self._gossip = None
+        self._latency = None
+        if latency_histogram:
+            from circuit._histogram import LatencyHistogram
+            self._latency = LatencyHistogram()
 
+        self._last_traceback = None
+        self._rejections = 0
+        self._rejections_since = None
         self._last_change = None
-        self._error_times = collections.deque([None] * max_fail)
-        self._num_calls = collections.deque([0] * max_fail)
+        self._calls_total = 0
+        self._errors_total = 0
+        self._half_life = half_life
+        if half_life is None:
+            self._error_times = collections.deque([None] * max_fail)
+            self._error_weights = collections.deque([0] * max_fail)
+            self._num_calls = collections.deque([0] * max_fail)
+        else:
+            self._error_times = self._error_weights = self._num_calls = None
+            self._decay_rate = math.log(2) / half_life
+            self._ewma_time = clock()
+            self._ewma_calls = 0.0
+            self._ewma_errors = 0.0
         self._state = 'closed'
+        if gossip is not None:
+            gossip.watch(self)
+
+    def reconfigure(self, max_fail=None, time_unit=None, max_error_rate=None,
+                    reset_timeout=None, half_life=None):
+        """Change the thresholds of the breaker without losing its state.
+
+        Only the given arguments are changed; see L{__init__} for their
+        meaning.  Pass 0 as C{time_unit} or C{max_error_rate} to stop using
+        it.  The window of errors is resized in place, keeping the most
+        recent samples.  The kind of window (C{time_unit} or C{half_life})
+        cannot be changed.
+
+        @raise ValueError: if the new combination of thresholds is invalid.
+        """
+        if time_unit is None:
+            time_unit = self._time_unit
+        if max_error_rate is None:
+            max_error_rate = self._max_error_rate
+        if half_life is None:
+            half_life = self._half_life
+        time_unit = time_unit or None
+        max_error_rate = max_error_rate or None
+        if (half_life is None) != (self._half_life is None):
+            raise ValueError('cannot switch between time_unit and half_life')
+        _check_thresholds(time_unit, max_error_rate, half_life)
+
+        if half_life is not None and half_life != self._half_life:
+            self._decay(self._clock())
+            self._half_life = half_life
+            self._decay_rate = math.log(2) / half_life
+        if max_fail is not None and self._half_life is None:
+            _resize(self._error_times, max_fail, None)
+            _resize(self._error_weights, max_fail, 0)
+            _resize(self._num_calls, max_fail, 0)
+        if max_fail is not None:
+            self._max_fail = max_fail
+        if reset_timeout is not None:
+            if self._state != 'open':
+                self._open_timeout = reset_timeout
+            self._reset_timeout = reset_timeout
+        self._time_unit = time_unit
+        self._max_error_rate = max_error_rate
 
     def __call__(self, func):
         """Decorate a function to be called in this circuit breaker's context."""
+        weight = self._weight
+        if weight is None:
+            @functools.wraps(func)
+            def wrapped(*args, **kwds):
+                with self.weighted(1):
+                    return func(*args, **kwds)
+        else:
+            @functools.wraps(func)
+            def wrapped(*args, **kwds):
+                with self.weighted(weight(*args, **kwds)):
+                    return func(*args, **kwds)
+        return wrapped
+
+    def weighted(self, weight):
+        """Return a context manager for a call of the given weight.
+
+        Use it instead of the breaker itself for calls that cost more (or
+        less) than a single call::
+
+            with breaker.weighted(len(keys)):
+                fetch(keys)
+        """
+        return _WeightedContext(self, weight)
+
+    def generator(self, func):
+        """Decorate a generator function to be iterated in this circuit
+        breaker's context, see L{iterate}."""
+        weight = self._weight
+
         @functools.wraps(func)
         def wrapped(*args, **kwds):
-            with self:
-                return func(*args, **kwds)
+            return self.iterate(func(*args, **kwds),
+                                1 if weight is None else weight(*args, **kwds))
         return wrapped
 
+    def iterate(self, iterable, weight=1, stall_timeout=None):
+        """Iterate over C{iterable} in this circuit breaker's context.
+
+        The breaker is entered when the first item is requested.  The call
+        is recorded as a success when C{iterable} is exhausted, and as an
+        error if it raises one of C{error_types}.  Nothing is recorded if
+        the iteration is abandoned early.
+
+        @param weight: The weight of the call.
+        @param stall_timeout: If given, a stream that takes longer than this
+            number of seconds to produce an item is recorded as an error as
+            soon as the late item arrives.  The iteration then continues
+            without recording anything more.  A stream that never produces
+            another item is not recorded; give the underlying connection a
+            read timeout for that.
+        @raise CircuitOpenError: if the circuit is open.
+        """
+        start = self._enter()
+        if stall_timeout is None:
+            try:
+                for item in iterable:
+                    yield item
+            except GeneratorExit:
+                raise
+            except:
+                self.__exit__(*sys.exc_info(), weight=weight, start=start)
+                raise
+            self.__exit__(None, None, None, weight, start)
+            return
+
+        clock = self._clock
+        last = clock()
+        try:
+            for item in iterable:
+                now = clock()
+                if now - last > stall_timeout:
+                    self._timed_out(weight, start)
+                    break
+                last = now
+                yield item
+            else:
+                if clock() - last > stall_timeout:
+                    self._timed_out(weight, start)
+                else:
+                    self.__exit__(None, None, None, weight, start)
+                return
+        except GeneratorExit:
+            raise
+        except:
+            self.__exit__(*sys.exc_info(), weight=weight, start=start)
+            raise
+        yield item
+        for item in iterable:
+            yield item
+
     def __enter__(self):
         """Context enter.
 
         @raise CircuitOpenError: if the circuit is still open
         """
+        if ((self._state != 'closed' or self._ramp_start is not None)
+                and self._admit(self._clock()) is not None):
+            if self._latency is not None:
+                self._latency.record('rejected', 0.0)
+            raise CircuitOpenError()
+
+    def _enter(self):
+        """Enter the breaker for a call whose latency is recorded.
+
+        @return: The time the call started, to be passed to L{__exit__}, or
+            C{None} if the breaker keeps no histogram.
+        @raise CircuitOpenError: if the circuit is still open
+        """
+        self.__enter__()
+        if self._latency is not None:
+            return self._clock()
+
+    def snapshot(self):
+        """Return a L{BreakerSnapshot} of the state of the breaker.
+
+        Its fields are C{state}; C{errors}, the number of errors in the
+        window (or the decayed error weight with C{half_life}); C{calls},
+        the total weight of the calls in the window (or the decayed call
+        weight); and C{retry_after}, the number of seconds until an open
+        circuit is due for C{half-open}, or C{None} if it is not open.
+        """
+        return BreakerSnapshot(*self._snapshot(self._clock()))
+
+    def _snapshot(self, now):
+        """Return the fields of L{snapshot} at time C{now} as a tuple."""
+        if self._half_life is None:
+            errors = self._max_fail - self._error_times.count(None)
+            for window in self._error_classes:
+                errors += window.max_fail - window.times.count(None)
+            calls = sum(self._num_calls)
+        else:
+            factor = math.exp(-max(0, now - self._ewma_time) * self._decay_rate)
+            errors = self._ewma_errors * factor
+            calls = self._ewma_calls * factor
+        retry_after = None
         if self._state == 'open':
-            delta = self._clock() - self._last_change
-            if delta < self._reset_timeout:
-                raise CircuitOpenError()
-            self._state = 'half-open'
-            self._log.debug('open => half-open (delta=%.2f sec)', delta)
+            retry_after = max(0.0, self._open_timeout - (now - self._last_change))
+        return self._state, errors, calls, retry_after
 
-    def __exit__(self, exc_type, exc_val, tb):
-        """Context exit."""
-        self._num_calls[-1] += 1
+    def latencies(self):
+        """Return a L{HistogramSnapshot} of the latencies of the calls so
+        far, or C{None} if the breaker keeps no histogram."""
+        if self._latency is None:
+            return None
+        return self._latency.snapshot()
+
+    def _admit(self, now):
+        """Decide whether a request at time C{now} is let through, moving an
+        open circuit that is due into C{half-open}.
+
+        @return: C{None} if the request is let through, otherwise the number
+            of seconds until the circuit is due for C{half-open}.
+        """
+        if self._state != 'open':
+            if self._ramp_start is None:
+                return None
+            fraction = self._ramp_fraction(now)
+            if fraction is None or random.random() < fraction:
+                return None
+            if self._log_interval is not None:
+                self._rejected(now)
+            return 0.0
+        delta = now - self._last_change
+        if delta < self._open_timeout or self._prober is not None:
+            if self._log_interval is not None:
+                self._rejected(now)
+            return max(0.0, self._open_timeout - delta)
+        if self._rejections:
+            self._log_rejections(now)
+        self._state = 'half-open'
+        self._log.debug('open => half-open (delta=%.2f sec)', delta)
+        self._transition('open', 'half-open', delta=delta)
+        return None
+
+    def _ramp_fraction(self, now):
+        """Return the fraction of requests admitted by the slow start at time
+        C{now}, or C{None} if it has ended."""
+        progress = (now - self._ramp_start) / self._slow_start
+        if progress >= 1:
+            self._ramp_start = None
+            self._log.debug('slow start finished')
+            return None
+        if self._slow_start_curve == 'exponential':
+            return _RAMP_START ** (1 - progress)
+        return _RAMP_START + (1 - _RAMP_START) * progress
+
+    def __exit__(self, exc_type, exc_val, tb, weight=1, start=None):
+        """Context exit.
+
+        @param weight: The weight of the call.
+        @param start: The time the call started, as returned by L{_enter}.
+            The latency of the call is only recorded if it is given.
+        """
+        self._count_call(weight)
         if exc_type is None or not isinstance(exc_val, self._error_types):
+            if start is not None and self._latency is not None:
+                self._latency.record('success' if exc_type is None
+                                     else 'unhandled', self._clock() - start)
             self._success()
-        else:
-            self._error(self._log_tracebacks and (exc_type, exc_val, tb) or None)
+            return False
+        open_for = None
+        if self._classify is not None:
+            open_for = self._classify(exc_val)
+            if open_for is False:
+                if start is not None and self._latency is not None:
+                    self._latency.record('success', self._clock() - start)
+                self._success()
+                return False
+            if open_for is True:
+                open_for = None
+        if start is not None and self._latency is not None:
+            self._latency.record('error', self._clock() - start)
+        self._error(self._log_tracebacks and (exc_type, exc_val, tb) or None,
+                    weight, open_for, exc_val)
         return False
 
-    def _error(self, exc_info=None):
-        """Update the circuit breaker with an error event."""
+    def _timed_out(self, weight=1, start=None):
+        """Record a call that did not finish in time as an error."""
+        if start is not None and self._latency is not None:
+            self._latency.record('error', self._clock() - start)
+        self._count_call(weight)
+        self._error(None, weight)
+
+    def _count_call(self, weight):
+        """Add a finished call to the window."""
+        self._calls_total += weight
+        if self._half_life is None:
+            self._num_calls[-1] += weight
+        else:
+            self._decay(self._clock())
+            self._ewma_calls += weight
+
+    def _decay(self, now):
+        """Decay the moving averages of calls and errors up to C{now}."""
+        elapsed = now - self._ewma_time
+        if elapsed > 0:
+            factor = math.exp(-elapsed * self._decay_rate)
+            self._ewma_calls *= factor
+            self._ewma_errors *= factor
+            self._ewma_time = now
+
+    def _error(self, exc_info=None, weight=1, open_for=None, exc=None):
+        """Update the circuit breaker with an error event.
+
+        @param open_for: If given, open the circuit for this number of
+            seconds regardless of the error rate.
+        @param exc: The exception, used to find its L{ErrorClass}.
+        """
         now = self._clock()
+        self._errors_total += weight
+        if self._gossip is not None:
+            self._gossip.error(self)
+        window = None
+        if exc is not None and self._error_classes:
+            for window in self._error_classes:
+                if isinstance(exc, window.error_types):
+                    break
+            else:
+                window = None
+        if window is not None:
+            set_open, error_rate, delta = self._add_class_error(window, now, weight)
+        elif self._half_life is None:
+            set_open, error_rate, delta = self._add_error(now, weight)
+        else:
+            set_open, error_rate, delta = self._add_decayed_error(now, weight)
+        if self._ramp_start is not None and not set_open:
+            fraction = self._ramp_fraction(now)
+            if fraction is not None:
+                self._ramp_errors += weight
+                set_open = self._ramp_errors > self._max_fail * fraction
+        if set_open or open_for is not None:
+            self._open(now, exc_info, error_rate, delta, open_for)
+
+    def _add_error(self, now, weight):
+        """Add an error to the window of errors.
+
+        @return: A tuple C{(set_open, error_rate, delta)}.
+        """
         self._error_times.append(now)
         earliest_error_time = self._error_times.popleft()
+        self._error_weights.append(weight)
+        self._error_weights.popleft()
 
         total_calls = sum(self._num_calls)
         self._num_calls.append(0)
         self._num_calls.popleft()
 
         set_open = True
+        delta = error_rate = None
         if self._state == 'closed':
             if earliest_error_time is None:
                 set_open = False
             else:
                 delta = now - earliest_error_time
-                error_rate = self._max_fail / total_calls
+                error_rate = total_calls and sum(self._error_weights) / total_calls
                 assert error_rate <= 1.0
 
                 if set_open and self._time_unit is not None:
                     set_open = delta < self._time_unit
                 if set_open and self._max_error_rate is not None:
                     set_open = error_rate >= self._max_error_rate
+        return set_open, error_rate, delta
+
+    def _add_class_error(self, window, now, weight):
+        """Add an error to the window of an L{ErrorClass}.
+
+        @return: A tuple C{(set_open, error_rate, delta)}.
+        """
+        window.times.append(now)
+        earliest_error_time = window.times.popleft()
+        window.weights.append(weight)
+        window.weights.popleft()
+        window.calls.append(self._calls_total)
+        earliest_calls = window.calls.popleft()
+
+        set_open = True
+        delta = error_rate = None
+        if self._state == 'closed':
+            if earliest_error_time is None:
+                set_open = False
+            else:
+                delta = now - earliest_error_time
+                total_calls = self._calls_total - earliest_calls
+                error_rate = total_calls and min(
+                    1.0, sum(window.weights) / total_calls)
+                if window.time_unit is not None:
+                    set_open = delta < window.time_unit
+                if set_open and window.max_error_rate is not None:
+                    set_open = error_rate >= window.max_error_rate
+        return set_open, error_rate, delta
+
+    def _add_decayed_error(self, now, weight):
+        """Add an error to the moving averages.
+
+        @return: A tuple C{(set_open, error_rate, None)}.
+        """
+        self._decay(now)
+        self._ewma_errors += weight
+
+        set_open = True
+        error_rate = None
+        if self._state == 'closed':
+            calls = self._ewma_calls
+            error_rate = calls and min(1.0, self._ewma_errors / calls)
+            set_open = self._ewma_errors > self._max_fail
+            if set_open and self._max_error_rate is not None:
+                set_open = error_rate >= self._max_error_rate
+        return set_open, error_rate, None
 
-        if set_open:
-            if self._state == 'closed':
+    def _open(self, now, exc_info, error_rate, delta, open_for=None):
+        """Open the circuit at time C{now} for C{open_for} seconds, or
+        C{reset_timeout} if not given."""
+        if exc_info is not None and not self._sample_traceback(now):
+            exc_info = None
+        if open_for is not None:
+            self._log.debug('%s => open (for %.2f sec)', self._state, open_for,
+                            exc_info=exc_info)
+        elif self._state == 'closed' and error_rate is not None:
+            if delta is None:
+                self._log.debug('closed => open (error_rate=%.2f%%)',
+                                100.0 * error_rate, exc_info=exc_info)
+            else:
                 self._log.debug('closed => open (delta=%.2f sec, error_rate=%.2f%%)',
                                 delta, 100.0 * error_rate, exc_info=exc_info)
-            else:
-                self._log.debug('%s => open', self._state, exc_info=exc_info)
-            self._state = 'open'
-            self._last_change = now
+        else:
+            self._log.debug('%s => open', self._state, exc_info=exc_info)
+        old_state, self._state = self._state, 'open'
+        self._last_change = now
+        self._open_timeout = self._reset_timeout if open_for is None else open_for
+        self._transition(old_state, 'open', error_rate, delta)
+
+    def _sample_traceback(self, now):
+        """Return true if a traceback should be logged at time C{now}."""
+        if (self._traceback_sample_rate < 1.0
+                and random.random() >= self._traceback_sample_rate):
+            return False
+        if self._log_interval is not None:
+            if (self._last_traceback is not None
+                    and now - self._last_traceback < self._log_interval):
+                return False
+            self._last_traceback = now
+        return True
+
+    def _rejected(self, now):
+        """Count a rejected request, logging a summary once per interval."""
+        if not self._rejections:
+            self._rejections_since = now
+        self._rejections += 1
+        if now - self._rejections_since >= self._log_interval:
+            self._log_rejections(now)
+
+    def _log_rejections(self, now):
+        self._log.info('%d rejections in the last %.2f sec',
+                       self._rejections, now - self._rejections_since)
+        self._rejections = 0
+        self._rejections_since = now
 
     def _success(self):
         if self._state == 'half-open':
             self._state = 'closed'
             self._log.debug('half-open => closed')
+            self._transition('half-open', 'closed')
+
+    def _probe_result(self, ok):
+        """Update an open circuit with the outcome of a background probe."""
+        if self._state != 'open':
+            return
+        if ok:
+            self._state = 'closed'
+            self._log.debug('open => closed (probe succeeded)')
+            self._transition('open', 'closed')
+        else:
+            self._last_change = self._clock()
+            self._open_timeout = self._reset_timeout
+            self._log.debug('open => open (probe failed)')
+            self._transition('open', 'open')
+
+    def _transition(self, from_state, to_state, error_rate=None, delta=None):
+        """Called after the state of the breaker has changed."""
+        if self._events is not None:
+            self._events.record(self._name, from_state, to_state, error_rate, delta)
+        if self._gossip is not None:
+            self._gossip.transition(self, to_state)
+        if to_state == 'open':
+            self._ramp_start = None
+            for notifier in self._reset_notifiers:
+                notifier.schedule(self)
+        elif to_state == 'closed' and self._slow_start is not None:
+            self._ramp_start = self._clock()
+            self._ramp_errors = 0
+
+    def _merge_gossip(self, errors, trip):
+        """Merge errors and trips of the peer seen by other nodes.
+
+        @param errors: The number of errors seen by other nodes.  They fill
+            the window of errors like local errors of no weight, so they
+            count towards C{max_fail} but not towards the error rate.  With
+            C{half_life} they are added to the moving average of errors.
+        @param trip: If true, open the circuit.
+        """
+        if self._state != 'closed':
+            return
+        now = self._clock()
+        set_open = False
+        error_rate = delta = None
+        if errors and self._half_life is None:
+            for _ in xrange(min(errors, self._max_fail + 1)):
+                set_open, error_rate, delta = self._add_error(now, 0)
+                if set_open:
+                    break
+        elif errors:
+            set_open, error_rate, delta = self._add_decayed_error(now, errors)
+        if set_open or trip:
+            self._open(now, None, error_rate, delta)
+
+    def _dump_state(self):
+        """Return the state of the breaker with all timestamps expressed as
+        ages (seconds before now according to C{clock}).
+
+        @return: A tuple C{(state, last_change_age, open_timeout, decayed,
+            error_ages, error_weights, num_calls)}.  Unused window slots have an age of
+            C{None}.  If C{decayed} is true, the moving averages are given as
+            a window with a single slot holding the time of the last decay,
+            the decayed error weight and the decayed call weight.
+        """
+        now = self._clock()
+        last_change = self._last_change
+        if last_change is not None:
+            last_change = now - last_change
+        if self._half_life is not None:
+            return (self._state, last_change, self._open_timeout, True,
+                    [now - self._ewma_time], [self._ewma_errors],
+                    [self._ewma_calls])
+        return (self._state, last_change, self._open_timeout, False,
+                [None if t is None else now - t for t in self._error_times],
+                list(self._error_weights),
+                list(self._num_calls))
+
+    def _load_state(self, state, last_change_age, open_timeout, decayed,
+                    error_ages, error_weights, num_calls):
+        """Restore state previously returned by L{_dump_state}, rebasing the
+        ages on the current reading of C{clock}.
+
+        If the saved window is of a different size than C{max_fail}, the most
+        recent samples are kept.  A window of a different kind than the one
+        used by this breaker is discarded.  A C{half-open} circuit is
+        restored as C{open}; the next caller will probe it again.
+        """
+        now = self._clock()
+        if state == 'half-open':
+            state = 'open'
+        if state == 'open' and last_change_age is None:
+            state = 'closed'
+        self._last_change = None if last_change_age is None else now - last_change_age
+        self._open_timeout = open_timeout
+        self._state = state
+        if state == 'open':
+            for notifier in self._reset_notifiers:
+                notifier.schedule(self)
+
+        if decayed != (self._half_life is not None):
+            return
+        if decayed:
+            self._ewma_time = now - error_ages[0]
+            self._ewma_errors = error_weights[0]
+            self._ewma_calls = num_calls[0]
+            return
+
+        max_fail = self._max_fail
+        if len(error_ages) != max_fail:
+            error_ages = list(error_ages[-max_fail:]) if max_fail else []
+            error_weights = list(error_weights[-max_fail:]) if max_fail else []
+            num_calls = list(num_calls[-max_fail:]) if max_fail else []
+            error_ages[:0] = [None] * (max_fail - len(error_ages))
+            error_weights[:0] = [0] * (max_fail - len(error_weights))
+            num_calls[:0] = [0] * (max_fail - len(num_calls))
+        self._error_times = collections.deque(
+            [None if age is None else now - age for age in error_ages])
+        self._error_weights = collections.deque(error_weights)
+        self._num_calls = collections.deque(num_calls)
+
+
+class _WeightedContext(object):
+    """Context manager for a call of a given weight, see
+    L{CircuitBreaker.weighted}."""
+
+    __slots__ = ('_breaker', '_weight', '_start')
+
+    def __init__(self, breaker, weight):
+        self._breaker = breaker
+        self._weight = weight
+        self._start = None
+
+    def __enter__(self):
+        self._start = self._breaker._enter()
+
+    def __exit__(self, exc_type, exc_val, tb):
+        return self._breaker.__exit__(exc_type, exc_val, tb, self._weight,
+                                      self._start)
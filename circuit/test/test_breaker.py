@@ -14,10 +14,10 @@
 
 """Test cases for the circuit breaker."""
 
-from mockito import mock
+from mockito import mock, verify
 from unittest import TestCase
 
-from circuit import CircuitBreaker, CircuitOpenError
+from circuit import CircuitBreaker, CircuitOpenError, ErrorClass
 
 
 class Clock(object):
@@ -45,7 +45,7 @@ class CircuitBreakerTestCaseMixin(object):
 
     @property
     def error_count(self):
-        return sum(1 for t in self.breaker._error_times if t is not None)
+        return self.breaker.snapshot().errors
 
     def success(self):
         self.breaker.__exit__(None, None, None)
@@ -195,3 +195,487 @@ class TimeRateBasedCircuitBreakerTestCase(CircuitBreakerTestCaseMixin, TestCase)
             self.error()
             self.clock.advance(1)
         self.assertEquals(self.breaker._state, 'open')
+
+
+class LogRateLimitTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.log = mock()
+        self.breaker = CircuitBreaker(max_fail=1, time_unit=60, reset_timeout=10,
+                                      error_types=(IOError,), log=self.log,
+                                      log_tracebacks=True, log_interval=5,
+                                      clock=self.clock.time)
+
+    def trip(self):
+        self.breaker._state = 'half-open'
+        self.breaker.__exit__(IOError, IOError(), None)
+
+    def test_logs_at_most_one_traceback_per_interval(self):
+        self.assertTrue(self.breaker._sample_traceback(0.0))
+        self.assertFalse(self.breaker._sample_traceback(4.0))
+        self.assertTrue(self.breaker._sample_traceback(5.0))
+        self.trip()
+        verify(self.log).debug('%s => open', 'half-open', exc_info=None)
+
+    def test_samples_tracebacks(self):
+        self.breaker._traceback_sample_rate = 0.0
+        self.assertFalse(self.breaker._sample_traceback(100.0))
+
+    def test_summarizes_rejections(self):
+        self.trip()
+        for i in range(6):
+            self.assertRaises(CircuitOpenError, self.breaker.__enter__)
+            self.clock.advance(1)
+        verify(self.log).info('%d rejections in the last %.2f sec', 6, 5.0)
+        self.assertRaises(CircuitOpenError, self.breaker.__enter__)
+        self.clock.advance(4)
+        self.breaker.__enter__()
+        verify(self.log).info('%d rejections in the last %.2f sec', 1, 4.0)
+
+
+class WeightedCircuitBreakerTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(max_fail=2, max_error_rate=0.5,
+                                      error_types=(IOError,), log=mock(),
+                                      clock=self.clock.time,
+                                      weight=lambda keys: len(keys))
+
+    def call(self, weight, fail=False):
+        try:
+            with self.breaker.weighted(weight):
+                if fail:
+                    raise IOError()
+        except IOError:
+            pass
+
+    def test_light_errors_do_not_open_circuit(self):
+        for i in range(3):
+            self.call(10)
+            self.call(1, fail=True)
+        self.assertEquals(self.breaker._state, 'closed')
+
+    def test_heavy_errors_open_circuit(self):
+        for i in range(3):
+            self.call(1)
+            self.call(10, fail=True)
+        self.assertEquals(self.breaker._state, 'open')
+
+    def test_decorator_weighs_calls_by_arguments(self):
+        @self.breaker
+        def fetch(keys):
+            if len(keys) > 1:
+                raise IOError()
+
+        for i in range(3):
+            fetch([1])
+            self.assertRaises(IOError, fetch, range(10))
+        self.assertEquals(self.breaker._state, 'open')
+        self.assertEquals(list(self.breaker._error_weights), [10, 10])
+
+
+class DecayedCircuitBreakerTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(max_fail=2, max_error_rate=0.4,
+                                      half_life=10, error_types=(IOError,),
+                                      log=mock(), clock=self.clock.time)
+
+    def success(self):
+        self.breaker.__exit__(None, None, None)
+
+    def error(self):
+        self.breaker.__exit__(IOError, IOError(), None)
+
+    def test_keeps_no_window(self):
+        self.assertEquals(self.breaker._error_times, None)
+
+    def test_requires_half_life_or_time_unit_exclusively(self):
+        self.assertRaises(ValueError, CircuitBreaker, max_fail=2,
+                          time_unit=60, half_life=10)
+
+    def test_decays_calls_and_errors(self):
+        self.error()
+        self.success()
+        self.clock.advance(10)
+        self.breaker._decay(self.clock.now)
+        self.assertAlmostEqual(self.breaker._ewma_errors, 0.5)
+        self.assertAlmostEqual(self.breaker._ewma_calls, 1.0)
+
+    def test_opens_on_recent_frequent_errors(self):
+        for i in range(3):
+            self.error()
+            self.clock.advance(1)
+        self.assertEquals(self.breaker._state, 'open')
+
+    def test_allows_old_frequent_errors(self):
+        for i in range(10):
+            self.error()
+            self.clock.advance(30)
+        self.assertEquals(self.breaker._state, 'closed')
+
+    def test_allows_recent_rare_errors(self):
+        for i in range(10):
+            self.error()
+            for i in range(4):
+                self.success()
+            self.clock.advance(1)
+        self.assertEquals(self.breaker._state, 'closed')
+
+    def test_closes_after_successful_probe(self):
+        self.test_opens_on_recent_frequent_errors()
+        self.clock.advance(10)
+        with self.breaker:
+            self.assertEquals(self.breaker._state, 'half-open')
+        self.assertEquals(self.breaker._state, 'closed')
+
+
+class StreamingCircuitBreakerTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(max_fail=2, time_unit=60,
+                                      error_types=(IOError,), log=mock(),
+                                      clock=self.clock.time)
+
+    @property
+    def error_count(self):
+        return self.breaker.snapshot().errors
+
+    @property
+    def call_count(self):
+        return self.breaker.snapshot().calls
+
+    def rows(self, n, fail=False, delays=()):
+        for i in range(n):
+            if i < len(delays):
+                self.clock.advance(delays[i])
+            yield i
+        if fail:
+            raise IOError()
+
+    def test_records_success_on_exhaustion(self):
+        stream = self.breaker.iterate(self.rows(3))
+        self.assertEquals(next(stream), 0)
+        self.assertEquals(self.call_count, 0)
+        self.assertEquals(list(stream), [1, 2])
+        self.assertEquals(self.call_count, 1)
+        self.assertEquals(self.error_count, 0)
+
+    def test_records_error_raised_during_iteration(self):
+        stream = self.breaker.iterate(self.rows(3, fail=True))
+        self.assertRaises(IOError, list, stream)
+        self.assertEquals(self.error_count, 1)
+
+    def test_records_nothing_when_abandoned(self):
+        stream = self.breaker.iterate(self.rows(3))
+        next(stream)
+        stream.close()
+        self.assertEquals(self.call_count, 0)
+
+    def test_rejects_when_open(self):
+        self.breaker._state = 'open'
+        self.breaker._last_change = self.clock.now
+        self.assertRaises(CircuitOpenError, list, self.breaker.iterate([1]))
+
+    def test_generator_decorator(self):
+        @self.breaker.generator
+        def rows(n):
+            for i in range(n):
+                yield i
+            raise IOError()
+        self.assertRaises(IOError, list, rows(2))
+        self.assertEquals(self.error_count, 1)
+
+    def test_records_stalled_stream_as_error_once(self):
+        stream = self.breaker.iterate(self.rows(4, fail=True, delays=(1, 5, 1)),
+                                      stall_timeout=2)
+        items = []
+        self.assertRaises(IOError, items.extend, stream)
+        self.assertEquals(items, [0, 1, 2, 3])
+        self.assertEquals(self.error_count, 1)
+        self.assertEquals(self.call_count, 1)
+
+    def test_records_stall_after_last_item(self):
+        def rows():
+            yield 1
+            self.clock.advance(3)
+        list(self.breaker.iterate(rows(), stall_timeout=2))
+        self.assertEquals(self.error_count, 1)
+
+    def test_fast_stream_with_stall_timeout_succeeds(self):
+        stream = self.breaker.iterate(self.rows(3, delays=(1, 1, 1)),
+                                      stall_timeout=2)
+        self.assertEquals(list(stream), [0, 1, 2])
+        self.assertEquals(self.error_count, 0)
+        self.assertEquals(self.call_count, 1)
+
+
+class ReconfigureTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(max_fail=3, time_unit=60,
+                                      error_types=(IOError,), log=mock(),
+                                      clock=self.clock.time)
+
+    def error(self):
+        self.breaker.__exit__(IOError, IOError(), None)
+        self.clock.advance(1)
+
+    def test_shrinking_window_keeps_recent_errors(self):
+        for i in range(3):
+            self.error()
+        self.breaker.reconfigure(max_fail=2)
+        self.assertEquals(list(self.breaker._error_times), [1.0, 2.0])
+        self.assertEquals(len(self.breaker._num_calls), 2)
+        self.error()
+        self.assertEquals(self.breaker._state, 'open')
+
+    def test_growing_window_keeps_errors(self):
+        self.error()
+        self.breaker.reconfigure(max_fail=4)
+        self.assertEquals(list(self.breaker._error_times), [None, None, None, 0.0])
+        self.assertEquals(list(self.breaker._error_weights), [0, 0, 0, 1])
+
+    def test_changes_thresholds(self):
+        self.breaker.reconfigure(max_error_rate=0.5, reset_timeout=3)
+        self.assertEquals(self.breaker._time_unit, 60)
+        self.assertEquals(self.breaker._max_error_rate, 0.5)
+        self.assertEquals(self.breaker._reset_timeout, 3)
+        self.breaker.reconfigure(time_unit=0)
+        self.assertEquals(self.breaker._time_unit, None)
+
+    def test_rejects_invalid_thresholds(self):
+        self.assertRaises(ValueError, self.breaker.reconfigure, time_unit=0)
+        self.assertRaises(ValueError, self.breaker.reconfigure, max_error_rate=2)
+        self.assertRaises(ValueError, self.breaker.reconfigure, half_life=10)
+        self.assertEquals(self.breaker._time_unit, 60)
+
+    def test_changes_half_life(self):
+        breaker = CircuitBreaker(max_fail=3, half_life=10, log=mock(),
+                                 clock=self.clock.time)
+        breaker.__exit__(None, None, None)
+        self.clock.advance(10)
+        breaker.reconfigure(half_life=20)
+        self.assertAlmostEqual(breaker._ewma_calls, 0.5)
+        self.clock.advance(20)
+        breaker._decay(self.clock.now)
+        self.assertAlmostEqual(breaker._ewma_calls, 0.25)
+
+
+class ClassifyTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(max_fail=3, time_unit=60, reset_timeout=10,
+                                      error_types=(IOError,), log=mock(),
+                                      clock=self.clock.time,
+                                      classify=lambda e: e.args and e.args[0])
+
+    def error(self, verdict=None):
+        self.breaker.__exit__(IOError, IOError(verdict), None)
+
+    @property
+    def error_count(self):
+        return self.breaker.snapshot().errors
+
+    def test_errors_rejected_by_classifier_are_successes(self):
+        self.breaker._state = 'half-open'
+        self.error(False)
+        self.assertEquals(self.error_count, 0)
+        self.assertEquals(self.breaker._state, 'closed')
+
+    def test_errors_accepted_by_classifier(self):
+        self.error(True)
+        self.error()
+        self.assertEquals(self.error_count, 2)
+        self.assertEquals(self.breaker._state, 'closed')
+
+    def test_suggested_open_duration_opens_immediately(self):
+        self.error(120)
+        self.assertEquals(self.breaker._state, 'open')
+        self.clock.advance(10)
+        self.assertRaises(CircuitOpenError, self.breaker.__enter__)
+        self.assertEquals(self.breaker._admit(self.clock.now), 110)
+        self.clock.advance(110)
+        self.breaker.__enter__()
+        self.assertEquals(self.breaker._state, 'half-open')
+
+    def test_next_trip_uses_reset_timeout(self):
+        self.error(120)
+        self.clock.advance(120)
+        self.breaker.__enter__()
+        self.error()
+        self.assertEquals(self.breaker._state, 'open')
+        self.clock.advance(10)
+        self.breaker.__enter__()
+
+
+class SlowStartTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(max_fail=10, time_unit=60, reset_timeout=10,
+                                      error_types=(IOError,), log=mock(),
+                                      clock=self.clock.time, slow_start=100)
+
+    def close(self):
+        self.breaker._state = 'half-open'
+        self.breaker.__enter__()
+        self.breaker.__exit__(None, None, None)
+
+    def admitted(self, tries=1000):
+        count = 0
+        for i in range(tries):
+            try:
+                self.breaker.__enter__()
+            except CircuitOpenError:
+                continue
+            count += 1
+            self.breaker.__exit__(None, None, None)
+        return count
+
+    def test_linear_ramp(self):
+        self.close()
+        self.assertEquals(self.breaker._ramp_fraction(self.clock.time()), 0.05)
+        self.clock.advance(50)
+        self.assertEquals(self.breaker._ramp_fraction(self.clock.time()), 0.525)
+        self.clock.advance(50)
+        self.assertEquals(self.breaker._ramp_fraction(self.clock.time()), None)
+        self.assertEquals(self.breaker._ramp_start, None)
+
+    def test_exponential_ramp(self):
+        self.breaker._slow_start_curve = 'exponential'
+        self.close()
+        self.clock.advance(50)
+        self.assertAlmostEqual(self.breaker._ramp_fraction(self.clock.time()),
+                               0.05 ** 0.5)
+
+    def test_admits_a_fraction_during_ramp(self):
+        self.close()
+        self.assertTrue(0 < self.admitted() < 150)
+        self.clock.advance(100)
+        self.assertEquals(self.admitted(), 1000)
+
+    def test_errors_during_ramp_reopen_early(self):
+        self.close()
+        self.clock.advance(50)
+        for i in range(5):
+            self.breaker.__exit__(IOError, IOError(), None)
+        self.assertEquals(self.breaker._state, 'closed')
+        self.breaker.__exit__(IOError, IOError(), None)
+        self.assertEquals(self.breaker._state, 'open')
+        self.assertEquals(self.breaker._ramp_start, None)
+
+    def test_no_ramp_by_default(self):
+        self.breaker = CircuitBreaker(max_fail=10, time_unit=60, log=mock(),
+                                      clock=self.clock.time)
+        self.close()
+        self.assertEquals(self.breaker._ramp_start, None)
+
+    def test_invalid_curve(self):
+        self.assertRaises(ValueError, CircuitBreaker, max_fail=10, time_unit=60,
+                          slow_start=10, slow_start_curve='cubic')
+
+
+class SnapshotTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def breaker(self, **kwds):
+        return CircuitBreaker(max_fail=2, reset_timeout=10, error_types=(IOError,),
+                              log=mock(), clock=self.clock.time, **kwds)
+
+    def test_counts_window(self):
+        breaker = self.breaker(time_unit=60)
+        breaker.__exit__(None, None, None)
+        breaker.__exit__(IOError, IOError(), None)
+        breaker.__exit__(None, None, None)
+        self.assertEquals(breaker.snapshot(), ('closed', 1, 3, None))
+
+    def test_time_until_half_open(self):
+        breaker = self.breaker(time_unit=60)
+        for i in range(3):
+            breaker.__exit__(IOError, IOError(), None)
+        self.clock.advance(4)
+        snapshot = breaker.snapshot()
+        self.assertEquals(snapshot.state, 'open')
+        self.assertEquals(snapshot.retry_after, 6)
+        self.clock.advance(20)
+        self.assertEquals(breaker.snapshot().retry_after, 0)
+
+    def test_decays(self):
+        breaker = self.breaker(half_life=10)
+        breaker.__exit__(IOError, IOError(), None)
+        self.clock.advance(10)
+        snapshot = breaker.snapshot()
+        self.assertAlmostEqual(snapshot.errors, 0.5)
+        self.assertAlmostEqual(snapshot.calls, 0.5)
+
+
+class ConnectError(IOError):
+    pass
+
+
+class ServerError(Exception):
+    pass
+
+
+class ErrorClassTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(
+            max_fail=5, time_unit=60, error_types=(IOError,), log=mock(),
+            clock=self.clock.time,
+            error_classes=[ErrorClass((ConnectError,), max_fail=1, time_unit=1),
+                           ErrorClass((ServerError,), max_fail=3,
+                                      max_error_rate=0.5)])
+
+    def error(self, exc_type):
+        self.breaker.__exit__(exc_type, exc_type(), None)
+
+    def success(self):
+        self.breaker.__exit__(None, None, None)
+
+    def test_fast_class_trips_quickly(self):
+        self.error(ConnectError)
+        self.assertEquals(self.breaker._state, 'closed')
+        self.error(ConnectError)
+        self.assertEquals(self.breaker._state, 'open')
+
+    def test_slow_class_in_its_own_window(self):
+        self.error(ConnectError)
+        self.clock.advance(2)
+        self.error(ConnectError)
+        self.assertEquals(self.breaker._state, 'closed')
+        for i in range(4):
+            self.error(ServerError)
+        self.assertEquals(self.breaker._state, 'open')
+
+    def test_classes_share_call_count(self):
+        for i in range(3):
+            self.error(ServerError)
+        for i in range(10):
+            self.success()
+        # 3 server errors in the 13 calls since the earliest one.
+        self.error(ServerError)
+        self.assertEquals(self.breaker._state, 'closed')
+        self.assertEquals(self.breaker.snapshot().errors, 3)
+
+    def test_other_errors_use_breaker_window(self):
+        for i in range(5):
+            self.error(IOError)
+        self.assertEquals(self.breaker._state, 'closed')
+        self.assertEquals(self.breaker.snapshot().errors, 5)
+        self.error(IOError)
+        self.assertEquals(self.breaker._state, 'open')
+
+    def test_not_with_half_life(self):
+        self.assertRaises(ValueError, CircuitBreaker, max_fail=1, half_life=10,
+                          error_classes=[ErrorClass((ServerError,), 1, 10)])
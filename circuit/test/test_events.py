@@ -0,0 +1,91 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the state change event log."""
+
+import json
+import os
+import shutil
+import tempfile
+from mockito import mock
+from unittest import TestCase
+
+from circuit import CircuitBreaker, EventLog, JSONLinesWriter, TransitionEvent
+from circuit.test.test_breaker import Clock
+
+
+class EventLogTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.batches = []
+        self.events = EventLog(self.batches.append, maxlen=4, batch_size=2,
+                               clock=self.clock.time)
+        self.breaker = CircuitBreaker(max_fail=2, time_unit=60, reset_timeout=10,
+                                      error_types=(IOError,), log=mock(),
+                                      clock=self.clock.time, name='peer',
+                                      events=self.events)
+
+    def error(self):
+        self.breaker.__exit__(IOError, IOError(), None)
+
+    def test_records_transitions(self):
+        for i in range(3):
+            self.error()
+            self.clock.advance(1)
+        self.clock.advance(10)
+        with self.breaker:
+            pass
+        self.assertEquals(self.events.drain(), [
+            TransitionEvent('peer', 'closed', 'open', 2.0, 1.0, 2.0),
+            TransitionEvent('peer', 'open', 'half-open', 13.0, None, 11.0)])
+        self.assertEquals(self.events.drain(), [
+            TransitionEvent('peer', 'half-open', 'closed', 13.0, None, None)])
+        self.assertEquals(self.events.drain(), [])
+
+    def test_flush_passes_batches_to_sink(self):
+        for i in range(3):
+            self.events.record('peer', 'closed', 'open')
+        self.events.flush()
+        self.assertEquals([len(batch) for batch in self.batches], [2, 1])
+
+    def test_overwrites_oldest_events_when_full(self):
+        for i in range(6):
+            self.clock.advance(1)
+            self.events.record('peer', 'closed', 'open')
+        self.assertEquals(self.events.dropped, 2)
+        self.assertEquals(self.events.drain()[0].timestamp, 3.0)
+
+    def test_name_defaults_to_log_name(self):
+        breaker = CircuitBreaker(max_fail=2, time_unit=60, log='peer')
+        self.assertEquals(breaker._name, 'peer')
+
+
+class JSONLinesWriterTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_appends_json_lines(self):
+        path = os.path.join(self.dir, 'events.jsonl')
+        writer = JSONLinesWriter(path)
+        writer([TransitionEvent('a', 'closed', 'open', 1.0, 0.5, 2.0)])
+        writer([TransitionEvent('b', 'open', 'half-open', 2.0, None, 10.0)])
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEquals([line['peer'] for line in lines], ['a', 'b'])
+        self.assertEquals(lines[0]['error_rate'], 0.5)
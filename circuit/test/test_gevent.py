@@ -0,0 +1,73 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the gevent circuit breaker."""
+
+import gevent
+from mockito import mock
+from unittest import TestCase
+
+from circuit import CircuitOpenError, GeventCircuitBreaker
+from circuit.test.test_breaker import Clock
+
+
+class GeventCircuitBreakerTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = GeventCircuitBreaker(max_fail=1, time_unit=60,
+                                            reset_timeout=10,
+                                            error_types=(IOError,), log=mock(),
+                                            clock=self.clock.time)
+        self.breaker._state = 'open'
+        self.breaker._last_change = self.clock.time()
+        self.clock.advance(10)
+        self.outcomes = []
+
+    def call(self, fail=False):
+        try:
+            with self.breaker:
+                gevent.sleep(0.001)
+                if fail:
+                    raise IOError()
+        except CircuitOpenError:
+            self.outcomes.append('rejected')
+        except IOError:
+            self.outcomes.append('failed')
+        else:
+            self.outcomes.append('passed')
+
+    def test_single_probe_in_half_open(self):
+        gevent.joinall([gevent.spawn(self.call) for _ in range(100)])
+        self.assertEquals(self.outcomes.count('passed'), 1)
+        self.assertEquals(self.outcomes.count('rejected'), 99)
+        self.assertEquals(self.breaker._state, 'closed')
+        gevent.joinall([gevent.spawn(self.call) for _ in range(100)])
+        self.assertEquals(self.outcomes.count('passed'), 101)
+
+    def test_failed_probe_reopens(self):
+        gevent.joinall([gevent.spawn(self.call, True)] +
+                       [gevent.spawn(self.call) for _ in range(10)])
+        self.assertEquals(self.outcomes.count('failed'), 1)
+        self.assertEquals(self.outcomes.count('rejected'), 10)
+        self.assertEquals(self.breaker._state, 'open')
+
+    def test_lost_probe_is_replaced(self):
+        self.breaker.__enter__()
+        self.assertEquals(self.breaker._state, 'half-open')
+        self.assertRaises(CircuitOpenError, self.breaker.__enter__)
+        self.clock.advance(10)
+        self.breaker.__enter__()
+        self.breaker.__exit__(None, None, None)
+        self.assertEquals(self.breaker._state, 'closed')
@@ -0,0 +1,132 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for gossip of breaker state between nodes."""
+
+from mockito import mock
+from unittest import TestCase
+
+from circuit import CircuitBreaker, Gossip
+from circuit.test.test_breaker import Clock
+
+
+class GossipTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.nodes = [Gossip([], clock=self.clock.time, log=mock())
+                      for _ in range(3)]
+        for node in self.nodes:
+            node.peers = [other.address for other in self.nodes
+                          if other is not node]
+        self.breakers = [self.breaker(node) for node in self.nodes]
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.close()
+
+    def breaker(self, node, name='db', **kwds):
+        return CircuitBreaker(max_fail=3, time_unit=60, reset_timeout=10,
+                              error_types=(IOError,), log=mock(), name=name,
+                              clock=self.clock.time, gossip=node, **kwds)
+
+    def error(self, breaker):
+        breaker.__exit__(IOError, IOError(), None)
+
+    def exchange(self, sender):
+        sender.flush()
+        for node in self.nodes:
+            if node is not sender:
+                self.assertTrue(node.receive(1.0))
+
+    def error_count(self, breaker):
+        return sum(1 for t in breaker._error_times if t is not None)
+
+    def test_errors_fill_remote_windows(self):
+        self.error(self.breakers[0])
+        self.error(self.breakers[0])
+        self.exchange(self.nodes[0])
+        self.assertEquals(self.error_count(self.breakers[1]), 2)
+        self.assertEquals(self.error_count(self.breakers[2]), 2)
+        self.assertEquals(sum(self.breakers[1]._error_weights), 0)
+
+    def test_remote_errors_open_circuit(self):
+        for breaker in self.breakers[:2]:
+            self.error(breaker)
+            self.error(breaker)
+        self.exchange(self.nodes[0])
+        self.exchange(self.nodes[1])
+        self.assertEquals(self.breakers[2]._state, 'open')
+
+    def test_trip_opens_remote_circuits(self):
+        self.breakers[0]._merge_gossip(0, True)
+        self.assertEquals(self.breakers[0]._state, 'open')
+        self.exchange(self.nodes[0])
+        self.assertEquals(self.breakers[1]._state, 'open')
+        self.assertEquals(self.breakers[2]._state, 'open')
+        # Circuits opened by gossip are not gossiped back.
+        self.assertEquals(self.nodes[1].encode(), [])
+
+    def test_quorum(self):
+        for node in self.nodes:
+            node._quorum = 2
+        self.breakers[0]._merge_gossip(0, True)
+        self.exchange(self.nodes[0])
+        self.assertEquals(self.breakers[2]._state, 'closed')
+        self.breakers[1]._merge_gossip(0, True)
+        self.nodes[1].flush()
+        self.nodes[2].receive(1.0)
+        self.assertEquals(self.breakers[2]._state, 'open')
+
+    def test_reports_expire(self):
+        for node in self.nodes:
+            node._quorum = 2
+        self.breakers[0]._merge_gossip(0, True)
+        self.exchange(self.nodes[0])
+        self.clock.advance(10)
+        self.breakers[1]._merge_gossip(0, True)
+        self.nodes[1].flush()
+        self.nodes[2].receive(1.0)
+        self.assertEquals(self.breakers[2]._state, 'closed')
+
+    def test_batches_and_rate_limits(self):
+        node = self.nodes[0]
+        node._max_packet = 100
+        node._packets_per_send = 2
+        names = ['peer-%d' % i for i in range(20)]
+        for name in names:
+            breaker = self.breaker(node, name)
+            self.error(breaker)
+            self.error(breaker)
+            self.error(breaker)
+        remote = [self.breaker(self.nodes[1], name) for name in names]
+        sends = 0
+        while node._pending:
+            packets = node.encode()
+            self.assertTrue(len(packets) <= 2)
+            self.assertTrue(all(len(p) <= 100 for p in packets))
+            for packet in packets:
+                self.nodes[1].merge(packet, ('127.0.0.1', 1))
+            sends += 1
+        self.assertTrue(sends > 1)
+        self.assertEquals([self.error_count(b) for b in remote], [3] * 20)
+
+    def test_ignores_unknown_breakers_and_bad_datagrams(self):
+        other = self.breaker(self.nodes[0], 'other')
+        self.error(other)
+        self.exchange(self.nodes[0])
+        self.assertRaises(ValueError, self.nodes[1].merge, b'junk', None)
+
+    def test_breakers_need_a_name(self):
+        self.assertRaises(ValueError, self.breaker, self.nodes[0], None)
@@ -0,0 +1,172 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for latency histograms."""
+
+import threading
+from mockito import mock
+from unittest import TestCase
+
+from circuit import (CircuitBreaker, CircuitOpenError, HistogramSnapshot,
+                     LatencyHistogram, ThreadSafeCircuitBreaker)
+from circuit._histogram import _bucket, bucket_upper_bound
+from circuit.test.test_breaker import Clock
+
+
+class LatencyHistogramTestCase(TestCase):
+
+    def test_buckets_are_within_an_eighth(self):
+        for seconds in (1e-6, 0.00123, 0.05, 0.1, 1.0, 7.5, 1000.0):
+            upper = bucket_upper_bound(_bucket(seconds))
+            self.assertTrue(seconds <= upper <= seconds * 1.125, seconds)
+
+    def test_extremes(self):
+        self.assertEquals(_bucket(0), 0)
+        self.assertEquals(_bucket(1e-9), 0)
+        self.assertEquals(_bucket(1e6), _bucket(5000))
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        for i in range(1, 101):
+            histogram.record('success', i / 1000.0)
+        histogram.record('error', 2.0)
+        snapshot = histogram.snapshot()
+        self.assertEquals(snapshot.count(), 101)
+        self.assertEquals(snapshot.count('success'), 100)
+        self.assertTrue(0.05 <= snapshot.percentile(50, 'success') <= 0.05 * 1.125)
+        self.assertTrue(0.099 <= snapshot.percentile(99, 'success') <= 0.099 * 1.125)
+        self.assertTrue(2.0 <= snapshot.percentile(100) <= 2.25)
+        self.assertEquals(snapshot.percentile(50, 'rejected'), None)
+
+    def test_threads_record_into_shards(self):
+        histogram = LatencyHistogram()
+
+        def record():
+            for i in range(1000):
+                histogram.record('success', 0.01)
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(len(histogram._shards) <= 4)
+        self.assertEquals(histogram.snapshot().count(), 4000)
+
+    def test_drops_shards_of_ended_threads(self):
+        histogram = LatencyHistogram()
+
+        def record():
+            histogram.record('success', 0.01)
+        for i in range(50):
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join()
+        record()
+        snapshot = histogram.snapshot()
+        self.assertEquals(snapshot.count('success'), 51)
+        self.assertTrue(len(histogram._shards) <= 2)
+        self.assertEquals(histogram.snapshot(), snapshot)
+
+    def test_merge_and_encode(self):
+        a, b = LatencyHistogram(), LatencyHistogram()
+        a.record('success', 0.01)
+        b.record('success', 0.01)
+        b.record('unhandled', 0.5)
+        merged = a.snapshot() + b.snapshot()
+        self.assertEquals(merged.count('success'), 2)
+        self.assertEquals(merged.count('unhandled'), 1)
+        self.assertEquals(HistogramSnapshot.decode(merged.encode()), merged)
+        self.assertRaises(ValueError, HistogramSnapshot.decode, b'PCBH\x09\0\0\0\0')
+        self.assertRaises(ValueError, HistogramSnapshot.decode, b'PC')
+
+
+class BreakerLatencyTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(max_fail=1, time_unit=60,
+                                      error_types=(IOError,), log=mock(),
+                                      clock=self.clock.time,
+                                      latency_histogram=True)
+
+    def call(self, seconds, exc_type=None):
+        try:
+            with self.breaker.weighted(1):
+                self.clock.advance(seconds)
+                if exc_type is not None:
+                    raise exc_type()
+        except (exc_type or ()):
+            pass
+
+    def test_records_outcomes(self):
+        self.call(0.1)
+        self.call(0.2, ValueError)
+        self.call(0.3, IOError)
+        self.call(0.4, IOError)
+        self.assertEquals(self.breaker._state, 'open')
+        self.assertRaises(CircuitOpenError, self.call, 0.5)
+        snapshot = self.breaker.latencies()
+        self.assertEquals([snapshot.count(outcome) for outcome in
+                           ('success', 'unhandled', 'error', 'rejected')],
+                          [1, 1, 2, 1])
+        self.assertTrue(0.1 <= snapshot.percentile(100, 'success') < 0.1125)
+        self.assertTrue(0.4 <= snapshot.percentile(100, 'error') < 0.45)
+
+    def test_nested_calls(self):
+        with self.breaker.weighted(1):
+            self.clock.advance(1)
+            with self.breaker.weighted(1):
+                self.clock.advance(0.01)
+        snapshot = self.breaker.latencies()
+        self.assertTrue(0.01 <= snapshot.percentile(50) < 0.0115)
+        self.assertTrue(1.01 <= snapshot.percentile(100) < 1.14)
+
+    def test_overlapping_calls(self):
+        # Calls interleaved in one thread, as with inlineCallbacks or
+        # streams, finish in any order.
+        first = self.breaker.weighted(1)
+        first.__enter__()
+        self.clock.advance(1)
+        second = self.breaker.weighted(1)
+        second.__enter__()
+        self.clock.advance(100)
+        first.__exit__(None, None, None)
+        self.clock.advance(1)
+        second.__exit__(None, None, None)
+        snapshot = self.breaker.latencies()
+        self.assertTrue(101 <= snapshot.percentile(50) < 113.7)
+        self.assertTrue(101 <= snapshot.percentile(100) < 113.7)
+
+    def test_streams(self):
+        first = self.breaker.iterate(iter([1]))
+        second = self.breaker.iterate(iter([2]))
+        next(first)
+        self.clock.advance(10)
+        next(second)
+        self.clock.advance(1)
+        list(first)
+        self.clock.advance(0.01)
+        list(second)
+        snapshot = self.breaker.latencies()
+        self.assertTrue(1.01 <= snapshot.percentile(50) < 1.14)
+        self.assertTrue(11 <= snapshot.percentile(100) < 12.4)
+
+    def test_bare_context_records_rejections_only(self):
+        with self.breaker:
+            self.clock.advance(1)
+        self.assertEquals(self.breaker.latencies().count(), 0)
+
+    def test_disabled_by_default(self):
+        breaker = ThreadSafeCircuitBreaker(max_fail=1, time_unit=60)
+        self.assertEquals(breaker.latencies(), None)
@@ -0,0 +1,50 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the lazy attributes of the package."""
+
+import subprocess
+import sys
+from unittest import TestCase
+
+import circuit
+
+
+class LazyImportTestCase(TestCase):
+
+    def test_does_not_import_optional_backends(self):
+        code = ('import sys, circuit; '
+                'print(sorted(m for m, mod in sys.modules.items() if mod and ('
+                'm.split(".")[0] in ("twisted", "json", "multiprocessing") or '
+                'm.startswith("circuit."))))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEquals(output.strip(), "['circuit.breaker']")
+
+    def test_resolves_lazy_attributes(self):
+        from circuit._threadsafe import ThreadSafeCircuitBreaker
+        self.assertTrue(circuit.ThreadSafeCircuitBreaker is ThreadSafeCircuitBreaker)
+        self.assertTrue('TimerWheel' in dir(circuit))
+        for name in circuit.__all__:
+            self.assertTrue(getattr(circuit, name) is not None)
+
+    def test_star_import_without_optional_backends(self):
+        code = ('import sys; '
+                'sys.modules["gevent"] = sys.modules["twisted"] = None; '
+                'from circuit import *; '
+                'print(GeventCircuitBreaker.__name__)')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEquals(output.strip(), 'GeventCircuitBreaker')
+
+    def test_unknown_attribute(self):
+        self.assertRaises(AttributeError, getattr, circuit, 'NoSuchThing')
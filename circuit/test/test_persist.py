@@ -0,0 +1,167 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for saving and restoring circuit breaker state."""
+
+import os
+import shutil
+import tempfile
+from mockito import mock
+from unittest import TestCase
+
+from circuit import (CircuitBreaker, CircuitBreakerSet, CircuitOpenError,
+                     load_state, save_state)
+from circuit._persist import decode_state, encode_state
+from circuit.test.test_breaker import Clock
+
+
+class PersistTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'state')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def breaker(self, clock=None, max_fail=2):
+        return CircuitBreaker(max_fail=max_fail, time_unit=60, reset_timeout=10,
+                              error_types=(IOError,), log=mock(),
+                              clock=(clock or self.clock).time)
+
+    def open(self, breaker):
+        for i in range(3):
+            breaker.__exit__(IOError, IOError(), None)
+        self.assertEquals(breaker._state, 'open')
+
+    def test_restores_open_circuit_on_rebased_clock(self):
+        breakers = {'a': self.breaker(), 'b': self.breaker()}
+        self.clock.advance(1000)
+        self.open(breakers['a'])
+        self.clock.advance(4)
+        data = encode_state(breakers, wall_time=100.0)
+
+        clock = Clock()
+        restored = {'a': self.breaker(clock), 'b': self.breaker(clock)}
+        self.assertEquals(decode_state(restored, data, wall_time=101.0), 1)
+        self.assertEquals(restored['a']._state, 'open')
+        self.assertEquals(restored['a']._last_change, -5.0)
+        self.assertEquals(restored['b']._state, 'closed')
+        self.assertRaises(CircuitOpenError, restored['a'].__enter__)
+        clock.advance(5)
+        restored['a'].__enter__()
+        self.assertEquals(restored['a']._state, 'half-open')
+
+    def test_restores_open_duration(self):
+        breaker = CircuitBreaker(max_fail=2, time_unit=60, error_types=(IOError,),
+                                 log=mock(), clock=self.clock.time,
+                                 classify=lambda e: 120)
+        breaker.__exit__(IOError, IOError(), None)
+        restored = {'a': self.breaker()}
+        decode_state(restored, encode_state({'a': breaker}))
+        self.assertEquals(restored['a']._open_timeout, 120)
+
+    def test_restores_window_contents(self):
+        breakers = {'a': self.breaker()}
+        breakers['a'].__exit__(None, None, None)
+        breakers['a'].__exit__(IOError, IOError(), None)
+        self.clock.advance(3)
+        restored = {'a': self.breaker(Clock())}
+        decode_state(restored, encode_state(breakers, 0.0), 0.0)
+        self.assertEquals(list(restored['a']._error_times), [None, -3.0])
+        self.assertEquals(list(restored['a']._num_calls), [2, 0])
+
+    def test_keeps_most_recent_samples_when_window_size_differs(self):
+        breakers = {'a': self.breaker(max_fail=3)}
+        for i in range(3):
+            breakers['a'].__exit__(IOError, IOError(), None)
+            self.clock.advance(1)
+        restored = {'a': self.breaker(Clock(), max_fail=2)}
+        decode_state(restored, encode_state(breakers, 0.0), 0.0)
+        self.assertEquals(list(restored['a']._error_times), [-2.0, -1.0])
+
+    def test_restores_moving_averages(self):
+        breakers = {'a': CircuitBreaker(max_fail=2, half_life=10, log=mock(),
+                                        error_types=(IOError,),
+                                        clock=self.clock.time)}
+        breakers['a'].__exit__(IOError, IOError(), None)
+        self.clock.advance(3)
+        clock = Clock()
+        restored = {'a': CircuitBreaker(max_fail=2, half_life=10, log=mock(),
+                                        clock=clock.time)}
+        decode_state(restored, encode_state(breakers, 0.0), 0.0)
+        self.assertEquals(restored['a']._ewma_time, -3.0)
+        self.assertEquals(restored['a']._ewma_errors, 1.0)
+        self.assertEquals(restored['a']._ewma_calls, 1.0)
+
+    def test_discards_window_of_other_kind(self):
+        breakers = {'a': self.breaker()}
+        self.open(breakers['a'])
+        restored = {'a': CircuitBreaker(max_fail=2, half_life=10, log=mock(),
+                                        clock=self.clock.time)}
+        decode_state(restored, encode_state(breakers))
+        self.assertEquals(restored['a']._state, 'open')
+        self.assertEquals(restored['a']._ewma_errors, 0.0)
+
+    def test_leaves_out_healthy_breakers(self):
+        breakers = {'a': self.breaker()}
+        breakers['a'].__exit__(None, None, None)
+        self.assertEquals(decode_state({'a': self.breaker()},
+                                       encode_state(breakers)), 0)
+
+    def test_keeps_errors_of_no_weight(self):
+        breaker = self.breaker()
+        breaker.__exit__(IOError, IOError(), None, weight=0)
+        restored = self.breaker()
+        self.assertEquals(decode_state({'a': restored},
+                                       encode_state({'a': breaker})), 1)
+        self.assertEquals(restored.snapshot().errors, 1)
+
+    def test_ignores_unknown_peers(self):
+        breaker = self.breaker()
+        breaker.__exit__(IOError, IOError(), None)
+        data = encode_state({u'p\xe9er': breaker})
+        self.assertEquals(decode_state({'other': self.breaker()}, data), 0)
+        self.assertEquals(decode_state({u'p\xe9er': self.breaker()}, data), 1)
+
+    def test_creates_breakers_of_a_set(self):
+        breakers = CircuitBreakerSet(max_fail=2, time_unit=60, reset_timeout=10,
+                                     error_types=(IOError,), log=mock(),
+                                     clock=self.clock.time)
+        self.open(breakers['a'])
+        breakers['b'].__exit__(None, None, None)
+        restored = CircuitBreakerSet(max_fail=2, time_unit=60,
+                                     reset_timeout=10, error_types=(IOError,),
+                                     log=mock(), clock=self.clock.time)
+        self.assertEquals(decode_state(restored, encode_state(breakers)), 1)
+        self.assertEquals(list(restored), ['a'])
+        self.assertEquals(restored['a']._state, 'open')
+
+    def test_rejects_garbage(self):
+        self.assertRaises(ValueError, decode_state, {}, b'garbage')
+        data = encode_state({'a': self.breaker()})
+        self.assertRaises(ValueError, decode_state, {'a': self.breaker()}, data[:-3])
+
+    def test_save_and_load_file(self):
+        breakers = {'a': self.breaker()}
+        self.open(breakers['a'])
+        save_state(breakers, self.path)
+        self.assertEquals(os.listdir(self.dir), ['state'])
+        restored = {'a': self.breaker()}
+        self.assertEquals(load_state(restored, self.path), 1)
+        self.assertEquals(restored['a']._state, 'open')
+
+    def test_load_missing_file(self):
+        self.assertEquals(load_state({}, self.path), 0)
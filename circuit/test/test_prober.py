@@ -0,0 +1,88 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for background health probing."""
+
+from mockito import mock
+from unittest import TestCase
+
+from circuit import (CircuitOpenError, HealthProber, ThreadSafeCircuitBreaker,
+                     TimerWheel)
+from circuit.test.test_breaker import Clock
+
+
+class HealthProberTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimerWheel(tick=1.0, clock=self.clock.time, log=mock())
+        self.prober = HealthProber(self.wheel, executor=lambda f, args: f(*args),
+                                   log=mock())
+        self.breaker = ThreadSafeCircuitBreaker(
+            max_fail=2, time_unit=60, reset_timeout=10, error_types=(IOError,),
+            log=mock(), clock=self.clock.time)
+        self.probes = []
+        self.healthy = False
+        self.prober.attach(self.breaker, self.probe)
+
+    def probe(self):
+        self.probes.append(self.clock.now)
+        if not self.healthy:
+            raise IOError()
+
+    def advance(self, seconds):
+        self.clock.advance(seconds)
+        self.wheel.advance()
+
+    def open(self):
+        for i in range(3):
+            self.breaker.__exit__(IOError, IOError(), None)
+        self.assertEquals(self.breaker._state, 'open')
+
+    def test_user_requests_rejected_until_probe_succeeds(self):
+        self.open()
+        self.advance(10)
+        self.assertEquals(self.probes, [10.0])
+        self.assertRaises(CircuitOpenError, self.breaker.__enter__)
+        self.advance(10)
+        self.assertEquals(self.probes, [10.0, 20.0])
+        self.healthy = True
+        self.advance(10)
+        self.assertEquals(self.breaker._state, 'closed')
+        self.breaker.__enter__()
+
+    def test_probe_returning_false_fails(self):
+        self.probe = lambda: False
+        self.prober.attach(self.breaker, self.probe)
+        self.open()
+        self.advance(10)
+        self.assertEquals(self.breaker._state, 'open')
+        self.assertEquals(self.breaker._last_change, 10.0)
+
+    def test_reschedules_when_reopened(self):
+        self.open()
+        self.advance(5)
+        self.breaker.__exit__(IOError, IOError(), None)
+        self.advance(5)
+        self.assertEquals(self.probes, [])
+        self.advance(5)
+        self.assertEquals(self.probes, [15.0])
+
+    def test_detach_lets_user_requests_probe(self):
+        self.open()
+        self.prober.detach(self.breaker)
+        self.advance(10)
+        self.assertEquals(self.probes, [])
+        self.breaker.__enter__()
+        self.assertEquals(self.breaker._state, 'half-open')
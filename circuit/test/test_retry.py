@@ -0,0 +1,119 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for retries coupled to the circuit breaker."""
+
+from mockito import mock
+from unittest import TestCase
+
+from circuit import CircuitBreaker, CircuitOpenError, Retry, RetryBudget
+from circuit.test.test_breaker import Clock
+
+
+class RetryBudgetTestCase(TestCase):
+
+    def test_spends_and_earns_tokens(self):
+        budget = RetryBudget(ratio=0.5, max_tokens=2)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+    def test_caps_tokens(self):
+        budget = RetryBudget(ratio=1, max_tokens=2)
+        for i in range(5):
+            budget.deposit()
+        self.assertEquals(budget.tokens, 2)
+
+    def test_earns_tokens_for_the_calls_of_a_breaker(self):
+        breaker = CircuitBreaker(max_fail=3, time_unit=60,
+                                 error_types=(IOError,), log=mock())
+        budget = RetryBudget(ratio=0.5, max_tokens=2)
+        breaker.__exit__(None, None, None)
+        budget._watch(breaker)
+        self.assertTrue(budget.withdraw(breaker))
+        self.assertTrue(budget.withdraw(breaker))
+        self.assertFalse(budget.withdraw(breaker))
+        for i in range(2):
+            with breaker:
+                pass
+        breaker.__exit__(IOError, IOError(), None)
+        self.assertTrue(budget.withdraw(breaker))
+        self.assertEquals(budget.tokens, 0)
+
+
+class RetryTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(max_fail=3, time_unit=60,
+                                      error_types=(IOError,), log=mock(),
+                                      clock=self.clock.time)
+        self.sleeps = []
+        self.budget = RetryBudget(ratio=0.5, max_tokens=2)
+        self.retry = Retry(self.breaker, attempts=3, budget=self.budget,
+                           backoff=1, sleep=self.sleeps.append)
+        self.calls = 0
+
+    def flaky(self, failures, exc_type=IOError):
+        def func():
+            self.calls += 1
+            if self.calls <= failures:
+                raise exc_type()
+            return self.calls
+        return func
+
+    def test_retries_with_backoff(self):
+        self.assertEquals(self.retry.call(self.flaky(2)), 3)
+        self.assertEquals(self.sleeps, [1, 2])
+        # The success is earned when the next retry is requested.
+        self.assertEquals(self.budget.tokens, 0)
+        self.assertFalse(self.budget.withdraw(self.breaker))
+        self.assertEquals(self.budget.tokens, 0.5)
+
+    def test_gives_up_after_attempts(self):
+        self.assertRaises(IOError, self.retry.call, self.flaky(5))
+        self.assertEquals(self.calls, 3)
+
+    def test_does_not_retry_unhandled_errors(self):
+        self.assertRaises(ValueError, self.retry.call, self.flaky(1, ValueError))
+        self.assertEquals(self.calls, 1)
+
+    def test_stops_when_budget_is_exhausted(self):
+        self.budget.withdraw()
+        self.budget.withdraw()
+        self.assertRaises(IOError, self.retry.call, self.flaky(1))
+        self.assertEquals(self.calls, 1)
+
+    def test_failing_peer_drains_budget(self):
+        self.breaker.reconfigure(max_fail=100)
+        for i in range(5):
+            self.calls = 0
+            self.assertRaises(IOError, self.retry.call, self.flaky(3))
+        self.assertEquals(self.budget.tokens, 0)
+        self.assertEquals(self.calls, 1)
+        self.assertEquals(self.breaker._calls_total, 7)
+
+    def test_stops_when_circuit_is_not_closed(self):
+        self.breaker._state = 'half-open'
+        self.assertRaises(IOError, self.retry.call, self.flaky(1))
+        self.assertEquals(self.calls, 1)
+        self.assertEquals(self.breaker._state, 'open')
+        self.assertRaises(CircuitOpenError, self.retry.call, self.flaky(0))
+
+    def test_decorator(self):
+        self.assertEquals(self.retry(self.flaky(1))(), 2)
@@ -0,0 +1,89 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for sets of circuit breakers."""
+
+from mockito import mock
+from unittest import TestCase
+
+from circuit import CircuitBreakerSet, ThreadSafeCircuitBreaker
+from circuit.test.test_breaker import Clock
+
+
+class CircuitBreakerSetTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breakers = CircuitBreakerSet(ThreadSafeCircuitBreaker,
+                                          clock=self.clock.time, max_fail=1,
+                                          time_unit=60, reset_timeout=10,
+                                          error_types=(IOError,), log=mock())
+
+    def open(self, peer):
+        for i in range(2):
+            self.breakers[peer].__exit__(IOError, IOError(), None)
+        self.assertEquals(self.breakers[peer]._state, 'open')
+
+    def test_creates_breakers_on_first_use(self):
+        breaker = self.breakers.context('a')
+        self.assertTrue(self.breakers['a'] is breaker)
+        self.assertEquals(breaker._name, 'a')
+        self.assertEquals(list(self.breakers), ['a'])
+        self.assertEquals(self.breakers.get('b'), None)
+
+    def test_admit_returns_admitted_peers_and_retry_times(self):
+        self.open('b')
+        self.clock.advance(4)
+        self.open('c')
+        self.clock.advance(2)
+        admitted, rejected = self.breakers.admit(['a', 'b', 'c', 'd'])
+        self.assertEquals(admitted, ['a', 'd'])
+        self.assertEquals(rejected, {'b': 4.0, 'c': 8.0})
+        self.assertEquals(len(self.breakers), 4)
+
+    def test_admit_moves_due_circuits_into_half_open(self):
+        self.open('a')
+        self.clock.advance(10)
+        admitted, rejected = self.breakers.admit(['a'])
+        self.assertEquals(admitted, ['a'])
+        self.assertEquals(self.breakers['a']._state, 'half-open')
+
+    def test_reconfigure_applies_to_existing_and_new_breakers(self):
+        self.breakers['a'].__exit__(IOError, IOError(), None)
+        self.breakers.reconfigure(max_fail=3, time_unit=0, max_error_rate=0.5)
+        self.assertEquals(list(self.breakers['a']._error_times), [None, None, 0.0])
+        self.assertEquals(self.breakers['b']._max_fail, 3)
+        self.assertEquals(self.breakers['b']._time_unit, None)
+
+    def test_reconfigure_rejects_invalid_thresholds_before_changing_any(self):
+        self.breakers['a']
+        self.assertRaises(ValueError, self.breakers.reconfigure, time_unit=0)
+        self.assertEquals(self.breakers['a']._time_unit, 60)
+
+
+class SetSnapshotTestCase(TestCase):
+
+    def test_columns(self):
+        clock = Clock()
+        breakers = CircuitBreakerSet(max_fail=1, time_unit=60, reset_timeout=10,
+                                     error_types=(IOError,), log=mock(),
+                                     clock=clock.time)
+        breakers['a'].__exit__(None, None, None)
+        for i in range(2):
+            breakers['b'].__exit__(IOError, IOError(), None)
+        clock.advance(3)
+        snapshot = breakers.snapshot()
+        rows = sorted(zip(*snapshot))
+        self.assertEquals(rows, [('a', 'closed', 0, 1, None),
+                                 ('b', 'open', 1, 0, 7)])
@@ -0,0 +1,100 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the striped circuit breaker."""
+
+import threading
+from mockito import mock
+from unittest import TestCase
+
+from circuit import StripedCircuitBreaker
+from circuit._persist import decode_state, encode_state
+from circuit.test.test_breaker import Clock
+
+
+class StripedCircuitBreakerTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = StripedCircuitBreaker(max_fail=2, time_unit=60,
+                                             max_error_rate=0.5,
+                                             error_types=(IOError,), log=mock(),
+                                             clock=self.clock.time)
+
+    def success(self):
+        with self.breaker:
+            pass
+
+    def error(self):
+        self.breaker.__exit__(IOError, IOError(), None)
+
+    def test_counts_calls_of_all_threads(self):
+        def calls():
+            for i in range(1000):
+                self.success()
+        threads = [threading.Thread(target=calls) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Counters of threads that have ended are dropped on the next read.
+        self.assertTrue(len(self.breaker._counters) <= 4)
+        self.assertEquals(list(self.breaker._num_calls), [0, 0])
+        self.assertEquals(self.breaker.snapshot().calls, 4000)
+
+    def test_drops_counters_of_ended_threads(self):
+        def calls():
+            for i in range(10):
+                self.success()
+        for i in range(50):
+            thread = threading.Thread(target=calls)
+            thread.start()
+            thread.join()
+        self.success()
+        self.assertEquals(self.breaker.snapshot().calls, 501)
+        self.assertTrue(len(self.breaker._counters) <= 2)
+        self.error()
+        self.assertEquals(list(self.breaker._num_calls), [502, 0])
+
+    def test_calls_are_folded_into_window_on_error(self):
+        for i in range(3):
+            self.success()
+        self.error()
+        self.assertEquals(list(self.breaker._num_calls), [4, 0])
+        for i in range(5):
+            self.success()
+        self.error()
+        self.assertEquals(list(self.breaker._num_calls), [6, 0])
+        self.assertEquals(self.breaker._state, 'closed')
+        # 2 errors over the 7 calls in the window is below the maximum rate.
+        self.error()
+        self.assertEquals(self.breaker._state, 'closed')
+        self.error()
+        self.assertEquals(self.breaker._state, 'open')
+
+    def test_persisted_window_includes_pending_calls(self):
+        self.success()
+        self.error()
+        self.success()
+        restored = StripedCircuitBreaker(max_fail=2, time_unit=60, log=mock(),
+                                         clock=self.clock.time)
+        self.success()
+        decode_state({'a': restored}, encode_state({'a': self.breaker}))
+        self.assertEquals(list(restored._num_calls), [2, 2])
+        self.assertEquals(restored.snapshot().calls, 4)
+
+    def test_reconfigure_keeps_pending_calls(self):
+        self.success()
+        self.breaker.reconfigure(max_fail=3)
+        self.assertEquals(list(self.breaker._num_calls), [0, 0, 1])
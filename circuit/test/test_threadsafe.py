@@ -0,0 +1,105 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the thread-safe circuit breaker."""
+
+import threading
+import time
+from mockito import mock
+from unittest import TestCase
+
+from circuit import CircuitOpenError, ThreadSafeCircuitBreaker
+
+
+class WaitingTestCase(TestCase):
+
+    def setUp(self):
+        self.breaker = ThreadSafeCircuitBreaker(
+            max_fail=1, time_unit=60, reset_timeout=0.1, error_types=(IOError,),
+            log=mock(), clock=time.time)
+
+    def open(self):
+        for i in range(2):
+            self.breaker.__exit__(IOError, IOError(), None)
+        self.assertEquals(self.breaker._state, 'open')
+
+    def test_does_not_wait_when_closed(self):
+        with self.breaker.waiting(timeout=0):
+            pass
+
+    def test_times_out(self):
+        self.open()
+        start = time.time()
+        def test():
+            with self.breaker.waiting(timeout=0.02):
+                pass
+        self.assertRaises(CircuitOpenError, test)
+        self.assertTrue(time.time() - start < 0.09)
+
+    def test_lets_one_waiter_probe_and_others_through_when_closed(self):
+        self.open()
+        admitted = []
+        def worker():
+            with self.breaker.waiting(timeout=5):
+                admitted.append(self.breaker._state)
+                time.sleep(0.05)
+        threads = [threading.Thread(target=worker) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(admitted, ['half-open'] + ['closed'] * 4)
+
+    def test_waits_again_after_failed_probe(self):
+        self.open()
+        results = []
+        def worker():
+            try:
+                with self.breaker.waiting(timeout=5):
+                    fail = not results
+                    results.append(time.time())
+                    if fail:
+                        raise IOError()
+            except IOError:
+                pass
+        threads = [threading.Thread(target=worker) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(len(results), 2)
+        self.assertTrue(results[1] - results[0] >= 0.09)
+
+    def test_leader_that_times_out_hands_over(self):
+        self.breaker.reconfigure(reset_timeout=0.3)
+        self.open()
+        admitted = []
+        def leader():
+            try:
+                with self.breaker.waiting(timeout=0.05):
+                    pass
+            except CircuitOpenError:
+                pass
+        def follower():
+            with self.breaker.waiting():
+                admitted.append(self.breaker._state)
+        first = threading.Thread(target=leader)
+        first.start()
+        time.sleep(0.02)
+        second = threading.Thread(target=follower)
+        second.daemon = True
+        second.start()
+        first.join()
+        second.join(2)
+        self.assertEquals(admitted, ['half-open'])
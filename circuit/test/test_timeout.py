@@ -0,0 +1,102 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for calls with a timeout."""
+
+import sys
+import threading
+import time
+import traceback
+from mockito import mock
+from unittest import TestCase
+
+from circuit import (CallTimeout, CircuitOpenError, ThreadSafeCircuitBreaker,
+                     TimeoutExecutor)
+
+
+class TimeoutExecutorTestCase(TestCase):
+
+    def setUp(self):
+        self.breaker = ThreadSafeCircuitBreaker(max_fail=2, time_unit=60,
+                                                error_types=(IOError,),
+                                                log=mock())
+        self.executor = TimeoutExecutor(workers=1, backlog=2)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.close()
+
+    def hang(self):
+        self.release.wait()
+
+    def test_returns_result(self):
+        self.assertEquals(self.executor.call(self.breaker, 1, max, 1, 2), 2)
+        self.assertEquals(sum(self.breaker._num_calls), 1)
+        self.assertEquals(self.breaker._error_times.count(None), 2)
+
+    def test_records_errors_of_the_call(self):
+        def fail():
+            raise IOError()
+        self.assertRaises(IOError, self.executor.call, self.breaker, 1, fail)
+        self.assertEquals(self.breaker._error_times.count(None), 1)
+
+    def test_keeps_traceback_of_the_call(self):
+        def fail():
+            raise IOError()
+        try:
+            self.executor.call(self.breaker, 1, fail)
+        except IOError:
+            tb = sys.exc_info()[2]
+        self.assertEquals(traceback.extract_tb(tb)[-1][2], 'fail')
+
+    def test_records_timeout_as_error(self):
+        self.assertRaises(CallTimeout, self.executor.call, self.breaker,
+                          0.01, self.hang)
+        self.assertEquals(self.breaker._error_times.count(None), 1)
+        self.assertEquals(sum(self.breaker._num_calls), 1)
+
+    def test_queued_call_is_not_started_after_timeout(self):
+        calls = []
+        self.assertRaises(CallTimeout, self.executor.call, self.breaker,
+                          0.01, self.hang)
+        self.assertRaises(CallTimeout, self.executor.call, self.breaker,
+                          0.01, calls.append, 1)
+        self.release.set()
+        self.assertEquals(self.executor.call(self.breaker, 1, len, 'ab'), 2)
+        self.assertEquals(calls, [])
+
+    def test_fails_at_once_when_queue_is_full(self):
+        self.breaker.reconfigure(max_fail=10)
+        for i in range(3):
+            self.assertRaises(CallTimeout, self.executor.call, self.breaker,
+                              0.01, self.hang)
+        calls = []
+        start = time.time()
+        self.assertRaises(CallTimeout, self.executor.call, self.breaker,
+                          5, calls.append, 1)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEquals(self.breaker._error_times.count(None), 6)
+        self.release.set()
+        time.sleep(0.1)
+        self.assertEquals(self.executor.call(self.breaker, 1, len, 'ab'), 2)
+        self.assertEquals(calls, [])
+
+    def test_timeouts_open_circuit(self):
+        for i in range(3):
+            self.assertRaises(CallTimeout, self.executor.call, self.breaker,
+                              0.01, self.hang)
+        self.assertEquals(self.breaker._state, 'open')
+        self.assertRaises(CircuitOpenError, self.executor.call, self.breaker,
+                          1, len, 'ab')
@@ -0,0 +1,146 @@
+# Copyright 2012 Edgeware AB.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cases for the timer wheel."""
+
+from mockito import mock
+from unittest import TestCase
+
+from circuit import CircuitBreaker, ResetNotifier, TimerWheel
+from circuit.test.test_breaker import Clock
+
+
+class TimerWheelTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimerWheel(tick=1.0, size=8, clock=self.clock.time, log=mock())
+        self.fired = []
+
+    def advance(self, seconds):
+        self.clock.advance(seconds)
+        self.wheel.advance()
+
+    def test_fires_due_timers(self):
+        self.wheel.schedule(2.5, self.fired.append, 'a')
+        self.wheel.schedule(1, self.fired.append, 'b')
+        self.advance(1)
+        self.assertEquals(self.fired, ['b'])
+        self.advance(1)
+        self.assertEquals(self.fired, ['b'])
+        self.advance(1)
+        self.assertEquals(self.fired, ['b', 'a'])
+
+    def test_fires_timers_beyond_one_rotation(self):
+        timer = self.wheel.schedule(20, self.fired.append, 'a')
+        self.advance(12)
+        self.assertEquals(self.fired, [])
+        self.assertTrue(timer.active)
+        self.advance(8)
+        self.assertEquals(self.fired, ['a'])
+        self.assertFalse(timer.active)
+
+    def test_fires_timers_on_every_level(self):
+        for delay in (3, 20, 100, 600):
+            self.wheel.schedule(delay, self.fired.append, delay)
+        for i in range(700):
+            self.advance(1)
+            if self.fired:
+                self.assertEquals(self.fired.pop(), i + 1)
+        self.assertEquals(self.fired, [])
+
+    def test_cancels_timers_on_higher_levels(self):
+        timer = self.wheel.schedule(100, self.fired.append, 'a')
+        self.advance(64)
+        timer.cancel()
+        self.advance(64)
+        self.assertEquals(self.fired, [])
+
+    def test_catches_up_after_long_pause(self):
+        self.wheel.schedule(3, self.fired.append, 'a')
+        self.wheel.schedule(30, self.fired.append, 'b')
+        self.advance(100)
+        self.assertEquals(sorted(self.fired), ['a', 'b'])
+
+    def test_cancelled_timers_do_not_fire(self):
+        timer = self.wheel.schedule(1, self.fired.append, 'a')
+        timer.cancel()
+        self.advance(2)
+        self.assertEquals(self.fired, [])
+        timer.cancel()
+
+    def test_timers_cancelled_by_a_due_timer_do_not_fire(self):
+        # Both are collected by the same advance, the earlier one first.
+        timers = []
+        self.wheel.schedule(1, lambda: timers[0].cancel())
+        timers.append(self.wheel.schedule(2, self.fired.append, 'a'))
+        self.advance(2)
+        self.assertEquals(self.fired, [])
+        self.assertFalse(timers[0].active)
+
+    def test_failing_callback_does_not_stop_others(self):
+        def fail():
+            raise RuntimeError()
+        self.wheel.schedule(1, fail)
+        self.wheel.schedule(1, self.fired.append, 'a')
+        self.advance(1)
+        self.assertEquals(self.fired, ['a'])
+
+
+class ResetNotifierTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimerWheel(tick=1.0, clock=self.clock.time, log=mock())
+        self.notifier = ResetNotifier(self.wheel)
+        self.breaker = CircuitBreaker(max_fail=1, time_unit=60, reset_timeout=10,
+                                      error_types=(IOError,), log=mock(),
+                                      clock=self.clock.time)
+        self.due = []
+        self.notifier.watch(self.breaker, self.due.append)
+
+    def advance(self, seconds):
+        self.clock.advance(seconds)
+        self.wheel.advance()
+
+    def open(self):
+        for i in range(2):
+            self.breaker.__exit__(IOError, IOError(), None)
+
+    def test_calls_back_when_reset_timeout_expires(self):
+        self.open()
+        self.advance(9)
+        self.assertEquals(self.due, [])
+        self.advance(1)
+        self.assertEquals(self.due, [self.breaker])
+        self.assertEquals(self.breaker._state, 'open')
+
+    def test_unwatch(self):
+        self.open()
+        self.notifier.unwatch(self.breaker)
+        self.assertEquals(self.breaker._reset_notifiers, ())
+        self.advance(10)
+        self.assertEquals(self.due, [])
+
+    def test_ignores_timers_of_earlier_openings(self):
+        self.open()
+        opened_at = self.breaker._last_change
+        self.clock.advance(10)
+        self.breaker.__enter__()
+        self.breaker.__exit__(IOError, IOError(), None)
+        self.assertEquals(self.breaker._state, 'open')
+        self.notifier._due(self.breaker, opened_at)
+        self.assertEquals(self.due, [])
+        self.advance(10)
+        self.assertEquals(self.due, [self.breaker])
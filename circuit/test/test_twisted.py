@@ -17,7 +17,8 @@ import unittest
 
 from twisted.internet import task, defer
 
-from circuit import TwistedCircuitBreaker
+from circuit import (CallLaterDriver, CallTimeout, CircuitOpenError, Retry,
+                     TimerWheel, TwistedCircuitBreaker)
 
 
 class TwistedCircuitBreakerTestCase(unittest.TestCase):
@@ -35,3 +36,139 @@ class TwistedCircuitBreakerTestCase(unittest.TestCase):
                 defer.returnValue(None)
         test()
         self.assertEquals(self.circuit_breaker._state, 'closed')
+
+
+class TwistedWaitTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = task.Clock()
+        self.breaker = TwistedCircuitBreaker(max_fail=1, time_unit=60,
+                                             reset_timeout=10,
+                                             error_types=(IOError,), log=mock(),
+                                             clock=self.reactor.seconds,
+                                             reactor=self.reactor)
+        for i in range(2):
+            self.breaker.__exit__(IOError, IOError(), None)
+
+    def enter(self, result, entered):
+        self.breaker.__enter__()
+        entered.append(self.breaker._state)
+
+    def test_fires_immediately_when_closed(self):
+        breaker = TwistedCircuitBreaker(max_fail=1, time_unit=60, log=mock())
+        fired = []
+        breaker.wait().addCallback(fired.append)
+        self.assertEquals(fired, [None])
+
+    def test_fires_one_waiter_when_due_and_rest_when_closed(self):
+        entered = []
+        for i in range(3):
+            self.breaker.wait().addCallback(self.enter, entered)
+        self.reactor.advance(9)
+        self.assertEquals(entered, [])
+        self.reactor.advance(1)
+        self.assertEquals(entered, ['half-open'])
+        self.breaker.__exit__(None, None, None)
+        self.assertEquals(entered, ['half-open', 'closed', 'closed'])
+
+    def test_times_out(self):
+        failures = []
+        self.breaker.wait(timeout=5).addErrback(failures.append)
+        self.reactor.advance(5)
+        self.assertEquals(len(failures), 1)
+        failures[0].trap(CircuitOpenError)
+        self.assertEquals(self.breaker._waiters, [])
+
+    def test_fires_next_waiter_if_woken_one_does_not_probe(self):
+        fired = []
+        self.breaker.wait().addCallback(fired.append)
+        self.breaker.wait().addCallback(self.enter, fired)
+        self.reactor.advance(10)
+        self.assertEquals(fired, [None, 'half-open'])
+
+
+class CallLaterDriverTestCase(unittest.TestCase):
+
+    def test_advances_wheel_from_event_loop(self):
+        reactor = task.Clock()
+        wheel = TimerWheel(tick=1.0, clock=reactor.seconds, log=mock())
+        fired = []
+        wheel.schedule(2.5, fired.append, 'a')
+        driver = CallLaterDriver(wheel, reactor.callLater)
+        driver.start()
+        reactor.pump([1] * 3)
+        self.assertEquals(fired, ['a'])
+        driver.stop()
+        self.assertEquals(reactor.getDelayedCalls(), [])
+
+
+
+class RetryDeferredTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = task.Clock()
+        self.breaker = TwistedCircuitBreaker(max_fail=3, time_unit=60,
+                                             error_types=(IOError,), log=mock(),
+                                             clock=self.reactor.seconds)
+        self.retry = Retry(self.breaker, attempts=3, backoff=1,
+                           reactor=self.reactor)
+        self.calls = 0
+
+    def flaky(self, failures):
+        def func():
+            self.calls += 1
+            if self.calls <= failures:
+                return defer.fail(IOError())
+            return defer.succeed(self.calls)
+        return func
+
+    def test_retries_with_backoff(self):
+        results = []
+        self.retry.call_deferred(self.flaky(2)).addCallback(results.append)
+        self.assertEquals(self.calls, 1)
+        self.reactor.advance(1)
+        self.assertEquals(self.calls, 2)
+        self.reactor.advance(2)
+        self.assertEquals(results, [3])
+        self.assertEquals(sum(self.breaker._num_calls), 3)
+
+    def test_fails_after_attempts(self):
+        failures = []
+        self.retry.call_deferred(self.flaky(5)).addErrback(failures.append)
+        self.reactor.pump([1, 2])
+        self.assertEquals(self.calls, 3)
+        failures[0].trap(IOError)
+
+    def test_fails_when_open(self):
+        self.breaker._state = 'open'
+        self.breaker._last_change = self.reactor.seconds()
+        failures = []
+        self.retry.call_deferred(self.flaky(0)).addErrback(failures.append)
+        failures[0].trap(CircuitOpenError)
+
+
+class CallWithTimeoutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = task.Clock()
+        self.breaker = TwistedCircuitBreaker(max_fail=1, time_unit=60,
+                                             log=mock(), reactor=self.reactor,
+                                             clock=self.reactor.seconds)
+
+    def test_returns_result(self):
+        results = []
+        d = self.breaker.call_with_timeout(1, defer.succeed, 'ok')
+        d.addCallback(results.append)
+        self.assertEquals(results, ['ok'])
+        self.assertEquals(sum(self.breaker._num_calls), 1)
+        self.assertFalse(self.reactor.getDelayedCalls())
+
+    def test_records_timeout_as_error(self):
+        hung = defer.Deferred()
+        failures = []
+        d = self.breaker.call_with_timeout(1, lambda: hung)
+        d.addErrback(failures.append)
+        self.reactor.advance(1)
+        failures[0].trap(CallTimeout)
+        self.assertEquals(self.breaker._error_times.count(None), 0)
+        self.assertEquals(sum(self.breaker._num_calls), 0)
@@ -0,0 +1,75 @@
+"""Run many concurrent greenlets through one circuit breaker.
+
+Each greenlet calls a fake peer in a loop.  The peer answers after a short
+sleep, and is down (failing every call) for part of the run.  For each
+breaker class the throughput, the outcomes and the largest number of calls
+that reached the peer while the circuit was half-open are printed.
+
+Usage: python gevent_bench.py [greenlets] [seconds]
+"""
+from __future__ import print_function
+import sys
+import timeit
+
+import gevent
+
+from circuit import (CircuitBreaker, CircuitOpenError, GeventCircuitBreaker,
+                     ThreadSafeCircuitBreaker)
+
+greenlets = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+duration = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+
+
+class FakePeer(object):
+    """A peer that is down between 1/3 and 2/3 of the run."""
+
+    def __init__(self, start, latency=0.005):
+        self.start = start
+        self.latency = latency
+        self.in_flight = 0
+        self.max_half_open = 0
+
+    def call(self, breaker):
+        self.in_flight += 1
+        if breaker._state == 'half-open':
+            self.max_half_open = max(self.max_half_open, self.in_flight)
+        try:
+            gevent.sleep(self.latency)
+            elapsed = timeit.default_timer() - self.start
+            if duration / 3 < elapsed < 2 * duration / 3:
+                raise IOError('down')
+        finally:
+            self.in_flight -= 1
+
+
+def run(factory):
+    breaker = factory(max_fail=20, time_unit=1, reset_timeout=0.2,
+                      error_types=(IOError,))
+    start = timeit.default_timer()
+    peer = FakePeer(start)
+    counts = {'passed': 0, 'failed': 0, 'rejected': 0}
+
+    def worker():
+        while timeit.default_timer() - start < duration:
+            try:
+                with breaker:
+                    peer.call(breaker)
+            except CircuitOpenError:
+                counts['rejected'] += 1
+                gevent.sleep(0.01)
+            except IOError:
+                counts['failed'] += 1
+            else:
+                counts['passed'] += 1
+
+    gevent.joinall([gevent.spawn(worker) for _ in range(greenlets)])
+    elapsed = timeit.default_timer() - start
+    total = sum(counts.values())
+    print('%-24s %8.0f calls/s  passed %7d  failed %6d  rejected %7d  '
+          'max half-open probes %d'
+          % (factory.__name__, total / elapsed, counts['passed'],
+             counts['failed'], counts['rejected'], peer.max_half_open))
+
+
+for factory in (CircuitBreaker, ThreadSafeCircuitBreaker, GeventCircuitBreaker):
+    run(factory)
@@ -0,0 +1,51 @@
+"""Measure the cost of `import circuit`.
+
+On Python 3.7 and later the cumulative time reported by `python -X
+importtime` for the package is printed.  On older versions the wall-clock
+time of starting an interpreter that imports the package is compared with
+one that does not.
+
+Usage: python import_bench.py [runs] [module]
+"""
+from __future__ import print_function
+import os
+import subprocess
+import sys
+import timeit
+
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+module = sys.argv[2] if len(sys.argv) > 2 else 'circuit'
+env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(*args):
+    return subprocess.Popen((sys.executable,) + args, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True).communicate()
+
+
+def importtime():
+    """Return the cumulative import time of `module` in microseconds."""
+    _, err = run('-X', 'importtime', '-c', 'import %s' % module)
+    for line in err.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1])
+    raise RuntimeError('no importtime output for %s' % module)
+
+
+def wall_time(code):
+    start = timeit.default_timer()
+    run('-c', code)
+    return timeit.default_timer() - start
+
+
+if sys.version_info >= (3, 7):
+    samples = sorted(importtime() for _ in range(runs))
+    print('import %s: median %d us, min %d us (cumulative, -X importtime)'
+          % (module, samples[len(samples) // 2], samples[0]))
+else:
+    base = min(wall_time('pass') for _ in range(runs))
+    total = min(wall_time('import %s' % module) for _ in range(runs))
+    print('import %s: %.1f ms (interpreter startup %.1f ms)'
+          % (module, 1000 * (total - base), 1000 * base))
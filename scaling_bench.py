@@ -0,0 +1,56 @@
+"""Measure how successful calls through one shared breaker scale with threads.
+
+For 1 to N threads, each thread makes a number of successful calls through
+the same breaker, and the total throughput is printed along with the number
+of calls the breaker counted, which is lower than the number made if
+updates were lost.  Threads only run in parallel on a free-threaded build
+of CPython; with a global interpreter lock the numbers show the overhead of
+each variant instead.
+
+Usage: python scaling_bench.py [max_threads] [calls_per_thread]
+"""
+from __future__ import print_function
+import multiprocessing
+import sys
+import threading
+import timeit
+
+from circuit import StripedCircuitBreaker, ThreadSafeCircuitBreaker
+
+max_threads = (int(sys.argv[1]) if len(sys.argv) > 1
+               else multiprocessing.cpu_count())
+calls = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+
+gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+print('%d cpus, GIL %s' % (multiprocessing.cpu_count(),
+                           'enabled' if gil else 'disabled'))
+
+
+def run(factory, threads):
+    breaker = factory(max_fail=10, time_unit=60)
+    start_barrier = threading.Event()
+
+    def worker():
+        start_barrier.wait()
+        for _ in range(calls):
+            with breaker:
+                pass
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    start = timeit.default_timer()
+    start_barrier.set()
+    for thread in workers:
+        thread.join()
+    elapsed = timeit.default_timer() - start
+    return threads * calls / elapsed, breaker.snapshot().calls
+
+
+threads = 1
+while threads <= max_threads:
+    for factory in (ThreadSafeCircuitBreaker, StripedCircuitBreaker):
+        rate, counted = run(factory, threads)
+        print('%-24s %3d threads %10.0f calls/s  counted %d of %d'
+              % (factory.__name__, threads, rate, counted, threads * calls))
+    threads *= 2